@@ -6,12 +6,27 @@ require("nonebot_plugin_uninfo")
 require("nonebot_plugin_localstore")
 
 from . import adapters as adapters
+from . import media_cache as media_cache
 from .message import deserialize_message as deserialize_message
+from .message import deserialize_messages as deserialize_messages
 from .message import serialize_message as serialize_message
 from .model import MessageRecord as MessageRecord
+from .record import MessageRecordPage as MessageRecordPage
+from .record import count_messages as count_messages
+from .record import get_context as get_context
 from .record import get_message_records as get_message_records
+from .record import get_record_by_message_id as get_record_by_message_id
+from .record import get_records_by_message_ids as get_records_by_message_ids
+from .record import get_message_records_page as get_message_records_page
+from .record import get_message_rows as get_message_rows
 from .record import get_messages as get_messages
 from .record import get_messages_plain_text as get_messages_plain_text
+from .record import get_recent_messages as get_recent_messages
+from .record import group_count as group_count
+from .record import iter_message_records as iter_message_records
+from .record import iter_message_rows as iter_message_rows
+from .record import iter_messages as iter_messages
+from .record import iter_messages_plain_text as iter_messages_plain_text
 
 __plugin_meta__ = PluginMetadata(
     name="聊天记录",
@@ -5,7 +5,6 @@ from typing import Any, Optional
 
 from nonebot.adapters import Bot as BaseBot
 from nonebot.message import event_postprocessor
-from nonebot_plugin_orm import get_session
 from nonebot_plugin_uninfo import (
     Scene,
     SceneType,
@@ -15,7 +14,6 @@ from nonebot_plugin_uninfo import (
     Uninfo,
     User,
 )
-from nonebot_plugin_uninfo.orm import get_session_persist_id
 from typing_extensions import override
 
 from ..config import plugin_config
@@ -28,6 +26,7 @@ from ..message import (
 )
 from ..model import MessageRecord
 from ..utils import record_type, remove_timezone
+from ..writer import record_buffer
 
 try:
     from nonebot.adapters.console import Bot, Message, MessageEvent, MessageSegment
@@ -40,19 +39,14 @@ try:
 
     @event_postprocessor
     async def record_recv_msg(event: MessageEvent, session: Uninfo):
-        session_persist_id = await get_session_persist_id(session)
-
         record = MessageRecord(
-            session_persist_id=session_persist_id,
             time=remove_timezone(event.time.astimezone(timezone.utc)),
             type=record_type(event),
             message_id=get_id(),
             message=serialize_message(adapter, event.get_message()),
             plain_text=event.get_plaintext(),
         )
-        async with get_session() as db_session:
-            db_session.add(record)
-            await db_session.commit()
+        await record_buffer.put(session, record)
 
     if plugin_config.chatrecorder_record_send_msg:
 
@@ -76,7 +70,6 @@ try:
                 scene=Scene(id=data["user_id"], type=SceneType.PRIVATE),
                 user=User(id=bot.self_id),
             )
-            session_persist_id = await get_session_persist_id(session)
 
             elements = ConsoleMessage(data["message"])
             message = Message()
@@ -92,16 +85,13 @@ try:
                     )
 
             record = MessageRecord(
-                session_persist_id=session_persist_id,
                 time=remove_timezone(datetime.now(timezone.utc)),
                 type="message_sent",
                 message_id=get_id(),
                 message=serialize_message(adapter, message),
                 plain_text=message.extract_plain_text(),
             )
-            async with get_session() as db_session:
-                db_session.add(record)
-                await db_session.commit()
+            await record_buffer.put(session, record)
 
     class Serializer(MessageSerializer[Message]):
         pass
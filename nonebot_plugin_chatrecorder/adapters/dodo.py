@@ -3,7 +3,6 @@ from typing import Any, Optional
 
 from nonebot.adapters import Bot as BaseBot
 from nonebot.message import event_postprocessor
-from nonebot_plugin_orm import get_session
 from nonebot_plugin_uninfo import (
     Scene,
     SceneType,
@@ -13,7 +12,6 @@ from nonebot_plugin_uninfo import (
     Uninfo,
     User,
 )
-from nonebot_plugin_uninfo.orm import get_session_persist_id
 from typing_extensions import override
 
 from ..config import plugin_config
@@ -26,6 +24,7 @@ from ..message import (
 )
 from ..model import MessageRecord
 from ..utils import record_type, remove_timezone
+from ..writer import record_buffer
 
 try:
     from nonebot.adapters.dodo import Bot, Message, MessageEvent
@@ -35,19 +34,14 @@ try:
 
     @event_postprocessor
     async def record_recv_msg(event: MessageEvent, session: Uninfo):
-        session_persist_id = await get_session_persist_id(session)
-
         record = MessageRecord(
-            session_persist_id=session_persist_id,
             time=remove_timezone(event.timestamp),
             type=record_type(event),
             message_id=event.message_id,
             message=serialize_message(adapter, event.get_message()),
             plain_text=event.get_plaintext(),
         )
-        async with get_session() as db_session:
-            db_session.add(record)
-            await db_session.commit()
+        await record_buffer.put(session, record)
 
     if plugin_config.chatrecorder_record_send_msg:
 
@@ -84,19 +78,15 @@ try:
                 scene=Scene(id=scene_id, type=scene_type, parent=parent),
                 user=User(id=bot.self_id),
             )
-            session_persist_id = await get_session_persist_id(session)
 
             record = MessageRecord(
-                session_persist_id=session_persist_id,
                 time=remove_timezone(datetime.now(timezone.utc)),
                 type="message_sent",
                 message_id=result.message_id,
                 message=serialize_message(adapter, message),
                 plain_text=message.extract_plain_text(),
             )
-            async with get_session() as db_session:
-                db_session.add(record)
-                await db_session.commit()
+            await record_buffer.put(session, record)
 
     class Serializer(MessageSerializer[Message]):
         pass
@@ -4,7 +4,6 @@ from typing import Any, Optional
 
 from nonebot.adapters import Bot as BaseBot
 from nonebot.message import event_postprocessor
-from nonebot_plugin_orm import get_session
 from nonebot_plugin_uninfo import (
     Scene,
     SceneType,
@@ -14,7 +13,6 @@ from nonebot_plugin_uninfo import (
     Uninfo,
     User,
 )
-from nonebot_plugin_uninfo.orm import get_session_persist_id
 from typing_extensions import override
 
 from ..config import plugin_config
@@ -27,6 +25,7 @@ from ..message import (
 )
 from ..model import MessageRecord
 from ..utils import record_type, remove_timezone
+from ..writer import record_buffer
 
 try:
     from nonebot.adapters.feishu import Bot, Message, MessageEvent
@@ -35,10 +34,7 @@ try:
 
     @event_postprocessor
     async def record_recv_msg(event: MessageEvent, session: Uninfo):
-        session_persist_id = await get_session_persist_id(session)
-
         record = MessageRecord(
-            session_persist_id=session_persist_id,
             time=remove_timezone(
                 datetime.fromtimestamp(
                     int(event.event.message.create_time) / 1000, timezone.utc
@@ -49,9 +45,7 @@ try:
             message=serialize_message(adapter, event.get_message()),
             plain_text=event.get_plaintext(),
         )
-        async with get_session() as db_session:
-            db_session.add(record)
-            await db_session.commit()
+        await record_buffer.put(session, record)
 
     _chat_info_cache: dict[str, dict[str, Any]] = {}
 
@@ -100,7 +94,6 @@ try:
                 scene=Scene(id=chat_id, type=scene_type),
                 user=User(id=bot.self_id),
             )
-            session_persist_id = await get_session_persist_id(session)
 
             msg_type = result_data["msg_type"]
             content = result_data["body"]["content"]
@@ -108,7 +101,6 @@ try:
             message = Message.deserialize(content, mentions, msg_type)
 
             record = MessageRecord(
-                session_persist_id=session_persist_id,
                 time=remove_timezone(
                     datetime.fromtimestamp(
                         int(result_data["create_time"]) / 1000, timezone.utc
@@ -119,9 +111,7 @@ try:
                 message=serialize_message(adapter, message),
                 plain_text=message.extract_plain_text(),
             )
-            async with get_session() as db_session:
-                db_session.add(record)
-                await db_session.commit()
+            await record_buffer.put(session, record)
 
     class Serializer(MessageSerializer[Message]):
         pass
@@ -1,12 +1,9 @@
-import base64
-import hashlib
 from datetime import datetime, timezone
-from pathlib import Path
 from typing import Any, Optional
 
 from nonebot.adapters import Bot as BaseBot
 from nonebot.message import event_postprocessor
-from nonebot_plugin_orm import get_session
+from nonebot.utils import run_sync
 from nonebot_plugin_uninfo import (
     Scene,
     SceneType,
@@ -16,11 +13,10 @@ from nonebot_plugin_uninfo import (
     Uninfo,
     User,
 )
-from nonebot_plugin_uninfo.orm import get_session_persist_id
 from typing_extensions import override
 
 from ..config import plugin_config
-from ..consts import IMAGE_CACHE_DIR, RECORD_CACHE_DIR, VIDEO_CACHE_DIR
+from ..media import MediaStore, image_store, record_store, video_store
 from ..message import (
     JsonMsg,
     MessageDeserializer,
@@ -31,6 +27,7 @@ from ..message import (
 )
 from ..model import MessageRecord
 from ..utils import record_type, remove_timezone
+from ..writer import record_buffer
 
 try:
     from nonebot.adapters.onebot.v11 import Bot, Message, MessageEvent, MessageSegment
@@ -39,19 +36,15 @@ try:
 
     @event_postprocessor
     async def record_recv_msg(event: MessageEvent, session: Uninfo):
-        session_persist_id = await get_session_persist_id(session)
-
+        await cache_b64_msg_async(event.get_message())
         record = MessageRecord(
-            session_persist_id=session_persist_id,
             time=remove_timezone(datetime.fromtimestamp(event.time, timezone.utc)),
             type=record_type(event),
             message_id=str(event.message_id),
             message=serialize_message(adapter, event.get_message()),
             plain_text=event.get_plaintext(),
         )
-        async with get_session() as db_session:
-            db_session.add(record)
-            await db_session.commit()
+        await record_buffer.put(session, record)
 
     if plugin_config.chatrecorder_record_send_msg:
 
@@ -90,49 +83,38 @@ try:
                 scene=Scene(id=scene_id, type=scene_type),
                 user=User(id=bot.self_id),
             )
-            session_persist_id = await get_session_persist_id(session)
 
             message = Message(data["message"])
+            await cache_b64_msg_async(message)
             record = MessageRecord(
-                session_persist_id=session_persist_id,
                 time=remove_timezone(datetime.now(timezone.utc)),
                 type="message_sent",
                 message_id=str(result["message_id"]),
                 message=serialize_message(adapter, message),
                 plain_text=message.extract_plain_text(),
             )
-            async with get_session() as db_session:
-                db_session.add(record)
-                await db_session.commit()
+            await record_buffer.put(session, record)
+
+    media_stores = {"image": image_store, "record": record_store, "video": video_store}
 
     def cache_b64_msg(msg: Message):
         for seg in msg:
-            if seg.type == "image":
-                cache_b64_msg_seg(seg, IMAGE_CACHE_DIR)
-            elif seg.type == "record":
-                cache_b64_msg_seg(seg, RECORD_CACHE_DIR)
-            elif seg.type == "video":
-                cache_b64_msg_seg(seg, VIDEO_CACHE_DIR)
+            if store := media_stores.get(seg.type):
+                cache_b64_msg_seg(seg, store)
 
-    def cache_b64_msg_seg(seg: MessageSegment, cache_dir: Path):
-        def replace_seg_file(path: Path):
-            seg.data["file"] = f"file:///{path.resolve()}"
+    async def cache_b64_msg_async(msg: Message):
+        """在线程池中缓存消息中 base64 形式的文件，避免阻塞事件循环"""
+        for seg in msg:
+            if store := media_stores.get(seg.type):
+                await run_sync(cache_b64_msg_seg)(seg, store)
 
+    def cache_b64_msg_seg(seg: MessageSegment, store: MediaStore):
         file = seg.data.get("file", "")
         if not file or not file.startswith("base64://"):
             return
 
-        data = base64.b64decode(file.replace("base64://", ""))
-        hash = hashlib.md5(data).hexdigest()
-        filename = f"{hash}.cache"
-        cache_file_path = cache_dir / filename
-        cache_files = [f.name for f in cache_dir.iterdir() if f.is_file()]
-        if filename in cache_files:
-            replace_seg_file(cache_file_path)
-        else:
-            with cache_file_path.open("wb") as f:
-                f.write(data)
-            replace_seg_file(cache_file_path)
+        hash = store.save_base64(file[len("base64://") :])
+        seg.data["file"] = store.uri(hash)
 
     class Serializer(MessageSerializer[Message]):
         @classmethod
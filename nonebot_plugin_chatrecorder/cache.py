@@ -0,0 +1,172 @@
+from collections import OrderedDict, deque
+from collections.abc import Hashable, Iterable
+from typing import Generic, Optional, TypeVar
+
+from nonebot.adapters import Message
+from nonebot_plugin_uninfo import Session
+from nonebot_plugin_uninfo.orm import get_session_persist_id as _get_session_persist_id
+
+from .config import plugin_config
+from .model import MessageRecord
+from .sql import LARGE_IN_THRESHOLD
+from .utils import adapter_value, scene_type_value, scope_value
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """有容量上限的 LRU 缓存
+
+    `maxsize` 小于等于 0 时不缓存任何内容
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        """ 命中次数 """
+        self.misses = 0
+        """ 未命中次数 """
+        self._data: OrderedDict[K, V] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._data
+
+    def get(self, key: K) -> Optional[V]:
+        if key in self._data:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+        self.misses += 1
+        return None
+
+    def set(self, key: K, value: V) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K) -> Optional[V]:
+        return self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class SessionGeneration:
+    """会话的版本号
+
+    写入消息记录时，每从数据库中获取一次会话持久化 id（即缓存未命中），版本号加一，
+    并记录最近 `maxsize` 次获取的会话持久化 id，
+    以便判断按会话筛选的缓存是否过期，以及过期后只需检查哪些会话
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.value = 0
+        """ 当前版本号 """
+        self._session_persist_ids: deque[int] = deque(maxlen=maxsize)
+
+    def bump(self, session_persist_ids: Iterable[int]) -> None:
+        for session_persist_id in session_persist_ids:
+            self.value += 1
+            self._session_persist_ids.append(session_persist_id)
+
+    def since(self, value: int) -> Optional[list[int]]:
+        """版本号 `value` 之后获取到的会话持久化 id，记录的数量不足时为 `None`"""
+        count = self.value - value
+        if count > len(self._session_persist_ids):
+            return None
+        ids = list(self._session_persist_ids)
+        return ids[len(ids) - count :]
+
+
+session_generation = SessionGeneration(LARGE_IN_THRESHOLD)
+""" 会话的版本号，只记录本进程中写入消息记录时获取的会话 """
+
+
+SessionKey = tuple[str, str, str, int, str, Optional[int], Optional[str], str]
+
+
+SceneKey = tuple[str, str, str, int, str]
+
+
+def scene_key(session: Session) -> SceneKey:
+    """事件场景的唯一标识，与按会话筛选时 `filter_user=False` 的筛选条件一致"""
+    return (
+        session.self_id,
+        adapter_value(session.adapter),
+        scope_value(session.scope),
+        scene_type_value(session.scene.type),
+        session.scene.id,
+    )
+
+
+def session_key(session: Session) -> SessionKey:
+    """会话在持久化时的唯一标识"""
+    parent = session.scene.parent
+    return (
+        session.self_id,
+        adapter_value(session.adapter),
+        scope_value(session.scope),
+        scene_type_value(session.scene.type),
+        session.scene.id,
+        scene_type_value(parent.type) if parent else None,
+        parent.id if parent else None,
+        session.user.id,
+    )
+
+
+def session_fingerprint(session: Session) -> int:
+    """会话中事件场景、用户及成员信息的指纹，用于判断是否需要更新数据库中的会话信息"""
+    return hash(
+        (
+            session.scene.dump_json(),
+            session.user.dump_json(),
+            session.member.dump_json() if session.member else None,
+        )
+    )
+
+
+session_persist_id_cache: LRUCache[SessionKey, tuple[int, int]] = LRUCache(
+    plugin_config.chatrecorder_session_cache_size
+)
+""" 会话持久化id缓存，值为会话持久化id与缓存时的会话信息指纹 """
+
+
+async def get_session_persist_id(session: Session) -> int:
+    """获取会话持久化id，优先从缓存中读取
+
+    会话信息与缓存时不一致时重新获取，以更新数据库中的会话信息
+    """
+    key = session_key(session)
+    fingerprint = session_fingerprint(session)
+    cached = session_persist_id_cache.get(key)
+    if cached is not None and cached[1] == fingerprint:
+        return cached[0]
+    session_persist_id = await _get_session_persist_id(session)
+    session_persist_id_cache.set(key, (session_persist_id, fingerprint))
+    session_generation.bump([session_persist_id])
+    return session_persist_id
+
+
+message_cache: LRUCache[int, Message] = LRUCache(
+    plugin_config.chatrecorder_message_cache_size
+)
+""" 反序列化后的消息缓存，键为消息记录 id
+
+缓存中的消息不应被修改，读取时需使用 `copy_message` 复制
+"""
+
+
+record_cache: LRUCache[tuple[SceneKey, str], MessageRecord] = LRUCache(
+    plugin_config.chatrecorder_record_cache_size
+)
+""" 按消息 id 获取的消息记录缓存，键为事件场景与消息 id
+
+缓存中的消息记录不应被修改，读取时需复制；写入消息记录后会清除对应的缓存
+"""
@@ -1,9 +1,29 @@
+from typing import Literal
+
 from nonebot import get_plugin_config
 from pydantic import BaseModel
 
 
 class Config(BaseModel):
     chatrecorder_record_send_msg: bool = True
+    chatrecorder_record_batch_size: int = 1
+    chatrecorder_record_flush_interval: float = 1.0
+    chatrecorder_record_max_queue_size: int = 10000
+    chatrecorder_record_nonblocking: bool = False
+    chatrecorder_record_overflow_policy: Literal["block", "drop_oldest", "spill"] = (
+        "block"
+    )
+    chatrecorder_spool_replay_interval: float = 60.0
+    chatrecorder_session_cache_size: int = 1024
+    chatrecorder_message_cache_size: int = 0
+    chatrecorder_record_cache_size: int = 1024
+    chatrecorder_recent_scene_size: int = 100
+    chatrecorder_recent_max_size: int = 10000
+    chatrecorder_query_resolve_sessions: bool = True
+    chatrecorder_message_validation: bool = False
+    chatrecorder_media_cache_max_size: int = 0
+    chatrecorder_media_cache_eviction_policy: Literal["keep", "tombstone"] = "keep"
+    chatrecorder_media_cache_evict_interval: float = 3600.0
 
 
 plugin_config = get_plugin_config(Config)
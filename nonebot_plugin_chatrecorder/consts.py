@@ -1,11 +1,14 @@
-from nonebot_plugin_localstore import get_cache_dir
+from nonebot_plugin_localstore import get_cache_dir, get_data_dir
 
 CACHE_DIR = get_cache_dir("nonebot_plugin_chatrecorder")
+DATA_DIR = get_data_dir("nonebot_plugin_chatrecorder")
 
 IMAGE_CACHE_DIR = CACHE_DIR / "images"
 RECORD_CACHE_DIR = CACHE_DIR / "records"
 VIDEO_CACHE_DIR = CACHE_DIR / "videos"
 
+SPOOL_FILE = DATA_DIR / "spool.jsonl"
+
 IMAGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
 RECORD_CACHE_DIR.mkdir(parents=True, exist_ok=True)
 VIDEO_CACHE_DIR.mkdir(parents=True, exist_ok=True)
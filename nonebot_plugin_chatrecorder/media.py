@@ -0,0 +1,106 @@
+import base64
+import hashlib
+import os
+import uuid
+from collections.abc import Iterator
+from pathlib import Path
+
+from .consts import IMAGE_CACHE_DIR, RECORD_CACHE_DIR, VIDEO_CACHE_DIR
+
+
+B64_CHUNK_SIZE = 4 * 256 * 1024
+""" 每次解码的 base64 字符数，需为 4 的倍数 """
+
+
+class MediaStore:
+    """内容寻址的媒体文件缓存
+
+    文件以内容的哈希值命名，并按哈希值的前两级前缀分目录存放，
+    如 `abcdef...` 存放于 `ab/cd/abcdef....cache`，避免单个目录中文件过多
+    """
+
+    suffix = ".cache"
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+
+    def path(self, key: str) -> Path:
+        """获取文件路径"""
+        return self.root / key[:2] / key[2:4] / f"{key}{self.suffix}"
+
+    def uri(self, key: str) -> str:
+        """获取用于消息段的文件 URI"""
+        return f"file:///{self.path(key).resolve()}"
+
+    def exists(self, key: str) -> bool:
+        return self.path(key).is_file()
+
+    def touch(self, path: Path) -> None:
+        """更新文件的修改时间，作为最近使用时间供缓存清理时参考"""
+        try:
+            path.touch()
+        except FileNotFoundError:
+            pass
+
+    def iter_files(self) -> Iterator[os.DirEntry[str]]:
+        """遍历所有缓存文件"""
+        if not self.root.is_dir():
+            return
+        stack = [self.root]
+        while stack:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(Path(entry.path))
+                    elif entry.name.endswith(self.suffix) and entry.is_file():
+                        yield entry
+
+    def save(self, key: str, data: bytes) -> Path:
+        """保存文件，已存在时不会重复写入"""
+        path = self.path(key)
+        if path.is_file():
+            self.touch(path)
+            return path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 先写入临时文件再重命名，避免写入中断时留下不完整的缓存文件
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+        return path
+
+    def save_base64(self, b64: str) -> str:
+        """分块解码 base64 数据并保存，返回文件内容的哈希值
+
+        解码、计算哈希值与写入均为分块进行，大文件不会占用与其大小相同的额外内存；
+        此方法为阻塞调用，在事件循环中应放在线程池中运行
+        """
+        if any(c in b64 for c in " \t\r\n"):
+            # 含有空白字符时分块边界会错位
+            b64 = "".join(b64.split())
+
+        hasher = hashlib.blake2b(digest_size=16)
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.root / f"{uuid.uuid4().hex}.tmp"
+        try:
+            with tmp_path.open("wb") as f:
+                for i in range(0, len(b64), B64_CHUNK_SIZE):
+                    chunk = base64.b64decode(b64[i : i + B64_CHUNK_SIZE])
+                    hasher.update(chunk)
+                    f.write(chunk)
+            key = hasher.hexdigest()
+            path = self.path(key)
+            if path.is_file():
+                tmp_path.unlink()
+                self.touch(path)
+            else:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path.replace(path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return key
+
+
+image_store = MediaStore(IMAGE_CACHE_DIR)
+record_store = MediaStore(RECORD_CACHE_DIR)
+video_store = MediaStore(VIDEO_CACHE_DIR)
@@ -0,0 +1,289 @@
+import asyncio
+import os
+from collections.abc import AsyncIterator, Collection, Iterable, Iterator
+from pathlib import Path
+from typing import Any, Literal, NamedTuple, Optional
+
+from nonebot import get_driver
+from nonebot.log import logger
+from nonebot.utils import run_sync
+from nonebot_plugin_orm import get_session
+from sqlalchemy import Text, cast, or_, select, update
+
+from .cache import message_cache, record_cache
+from .config import plugin_config
+from .media import MediaStore, image_store, record_store, video_store
+from .model import MessageRecord
+from .sql import in_values
+
+EvictionPolicy = Literal["keep", "tombstone"]
+
+FILE_URI_PREFIX = "file:///"
+TOMBSTONE_URI_PREFIX = "chatrecorder-evicted:///"
+""" 缓存文件被清理后，引用该文件的消息段中的 URI 会改写为此前缀加原文件名 """
+SCAN_BATCH_SIZE = 1000
+""" 查找引用时每次读取的消息记录数 """
+EVICT_BATCH_SIZE = 100
+""" 每次查找引用的文件数，每个文件在查询语句中对应一个 `LIKE` 条件 """
+
+
+class CachedFile(NamedTuple):
+    path: str
+    """ 文件绝对路径，与消息段中文件 URI 的路径部分一致 """
+    size: int
+    last_used: float
+    """ 最近使用时间，即文件的修改时间 """
+
+
+def _media_paths(message: Any) -> Iterator[tuple[dict[str, Any], str]]:
+    """遍历消息中引用了本地文件的消息段，返回消息段数据与文件路径"""
+    if not isinstance(message, list):
+        return
+    for seg in message:
+        if not isinstance(seg, dict):
+            continue
+        data = seg.get("data")
+        if not isinstance(data, dict):
+            continue
+        file = data.get("file")
+        if isinstance(file, str) and file.startswith(FILE_URI_PREFIX):
+            yield data, file[len(FILE_URI_PREFIX) :]
+
+
+async def _iter_media_records(
+    paths: Collection[str],
+) -> AsyncIterator[list[tuple[int, Any]]]:
+    """分批读取可能引用了给定文件的消息记录"""
+    message = cast(MessageRecord.message, Text)
+    # 缓存文件名即文件内容的哈希值，只读取消息内容中包含这些文件名的消息记录
+    condition = or_(
+        *(message.contains(Path(path).name, autoescape=True) for path in paths)
+    )
+    last_id = -1
+    while True:
+        statement = (
+            select(MessageRecord.id, MessageRecord.message)
+            .where(MessageRecord.id > last_id)
+            .where(condition)
+            .order_by(MessageRecord.id)
+            .limit(SCAN_BATCH_SIZE)
+        )
+        async with get_session() as db_session:
+            rows = list((await db_session.execute(statement)).tuples().all())
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield rows
+
+
+class MediaCacheManager:
+    """媒体文件缓存管理
+
+    缓存文件总大小超过 `max_size` 时，按最近使用时间从旧到新清理缓存文件；
+    清理前会查找引用了待清理文件的消息记录，
+    `keep` 策略下跳过仍被引用的文件，
+    `tombstone` 策略下照常清理，并先将引用该文件的消息段改写为占位 URI，再删除文件
+
+    `max_size` 小于等于 0 时不限制缓存大小
+    """
+
+    def __init__(
+        self,
+        stores: Iterable[MediaStore],
+        max_size: int,
+        policy: EvictionPolicy = "keep",
+    ) -> None:
+        self.stores = list(stores)
+        self.max_size = max_size
+        self.policy: EvictionPolicy = policy
+        self.evicted = 0
+        """ 已清理的文件数 """
+        self.tombstoned = 0
+        """ 已改写的消息记录数 """
+        self._running = False
+
+    def scan(self) -> list[CachedFile]:
+        """统计所有缓存文件，此方法为阻塞调用"""
+        files: list[CachedFile] = []
+        for store in self.stores:
+            # 使用绝对路径遍历，与消息段中的文件 URI 保持一致
+            for entry in MediaStore(store.root.resolve()).iter_files():
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append(CachedFile(entry.path, stat.st_size, stat.st_mtime))
+        return files
+
+    def unchanged(self, files: Iterable[CachedFile]) -> list[CachedFile]:
+        """筛选统计之后未被使用过的文件，此方法为阻塞调用"""
+        result: list[CachedFile] = []
+        for file in files:
+            try:
+                if os.stat(file.path).st_mtime <= file.last_used:
+                    result.append(file)
+            except FileNotFoundError:
+                continue
+        return result
+
+    def delete(self, files: Iterable[CachedFile]) -> list[CachedFile]:
+        """删除缓存文件，返回实际删除的文件；此方法为阻塞调用
+
+        统计之后又被使用过的文件会被跳过
+        """
+        deleted: list[CachedFile] = []
+        for file in files:
+            try:
+                if os.stat(file.path).st_mtime > file.last_used:
+                    continue
+                os.unlink(file.path)
+            except FileNotFoundError:
+                continue
+            deleted.append(file)
+        return deleted
+
+    async def find_references(self, paths: Collection[str]) -> dict[str, list[int]]:
+        """查找引用了给定文件的消息记录，返回各文件对应的消息记录 id"""
+        references: dict[str, list[int]] = {}
+        if not paths:
+            return references
+        targets = set(paths)
+        async for rows in _iter_media_records(targets):
+            for record_id, message in rows:
+                for _, path in _media_paths(message):
+                    if path in targets:
+                        references.setdefault(path, []).append(record_id)
+        return references
+
+    async def tombstone(self, references: dict[str, list[int]]) -> int:
+        """将消息记录中引用了给定文件的消息段改写为占位 URI，返回改写的消息记录数
+
+        `references` 为 `find_references` 的结果
+        """
+        record_ids = sorted({i for ids in references.values() for i in ids})
+        updated = 0
+        for start in range(0, len(record_ids), SCAN_BATCH_SIZE):
+            batch = record_ids[start : start + SCAN_BATCH_SIZE]
+            statement = select(MessageRecord.id, MessageRecord.message).where(
+                in_values(MessageRecord.id, batch)
+            )
+            params: list[dict[str, Any]] = []
+            async with get_session() as db_session:
+                # 重新读取消息内容，在同一个事务中改写
+                for record_id, message in (await db_session.execute(statement)).all():
+                    changed = False
+                    for data, path in _media_paths(message):
+                        if path in references:
+                            data["file"] = f"{TOMBSTONE_URI_PREFIX}{Path(path).name}"
+                            changed = True
+                    if changed:
+                        params.append({"id": record_id, "message": message})
+                if params:
+                    await db_session.execute(update(MessageRecord), params)
+                    await db_session.commit()
+            for param in params:
+                message_cache.pop(param["id"])
+            if params:
+                # 按消息 id 缓存的消息记录中也包含消息内容，直接清空
+                record_cache.clear()
+            updated += len(params)
+        return updated
+
+    async def evict(self) -> int:
+        """清理缓存文件直至总大小不超过上限，返回清理的文件数
+
+        遍历和删除文件均在线程池中进行，不会阻塞事件循环
+        """
+        if self.max_size <= 0 or self._running:
+            return 0
+
+        self._running = True
+        try:
+            files = await run_sync(self.scan)()
+            excess = sum(file.size for file in files) - self.max_size
+            if excess <= 0:
+                return 0
+
+            files.sort(key=lambda file: file.last_used)
+            evicting: list[CachedFile] = []
+            references: dict[str, list[int]] = {}
+            # 按批次从旧到新查找引用，清理足够的文件后不再查找
+            for start in range(0, len(files), EVICT_BATCH_SIZE):
+                if excess <= 0:
+                    break
+                batch = files[start : start + EVICT_BATCH_SIZE]
+                if self.policy == "tombstone":
+                    # 照常清理时只需查找将要清理的文件
+                    size = 0
+                    for end, file in enumerate(batch, 1):
+                        size += file.size
+                        if size >= excess:
+                            batch = batch[:end]
+                            break
+                found = await self.find_references([file.path for file in batch])
+                for file in batch:
+                    if excess <= 0:
+                        break
+                    if file.path in found:
+                        if self.policy == "keep":
+                            continue
+                        references[file.path] = found[file.path]
+                    evicting.append(file)
+                    excess -= file.size
+
+            if references:
+                # 先改写消息记录再删除文件，改写失败时文件不会被删除，下次清理时重试；
+                # 统计之后又被使用过的文件不会被删除，也不改写
+                unchanged = await run_sync(self.unchanged)(evicting)
+                paths = {file.path for file in unchanged}
+                self.tombstoned += await self.tombstone(
+                    {path: ids for path, ids in references.items() if path in paths}
+                )
+            deleted = await run_sync(self.delete)(evicting)
+            self.evicted += len(deleted)
+
+            if self.policy == "keep" and excess > 0:
+                logger.warning(
+                    f"chatrecorder: 媒体文件缓存清理后仍超出上限 {excess} 字节，"
+                    "剩余文件均被消息记录引用"
+                )
+            if deleted:
+                logger.info(f"chatrecorder: 已清理 {len(deleted)} 个媒体缓存文件")
+            return len(deleted)
+        finally:
+            self._running = False
+
+
+media_cache_manager = MediaCacheManager(
+    [image_store, record_store, video_store],
+    max_size=plugin_config.chatrecorder_media_cache_max_size,
+    policy=plugin_config.chatrecorder_media_cache_eviction_policy,
+)
+
+
+_evict_task: Optional[asyncio.Task[None]] = None
+
+
+async def _evict_periodically() -> None:
+    while True:
+        try:
+            await media_cache_manager.evict()
+        except Exception as e:
+            logger.opt(exception=e).error("chatrecorder: 媒体文件缓存清理失败")
+        await asyncio.sleep(plugin_config.chatrecorder_media_cache_evict_interval)
+
+
+driver = get_driver()
+
+
+@driver.on_startup
+async def _():
+    global _evict_task
+    if media_cache_manager.max_size > 0:
+        _evict_task = asyncio.create_task(_evict_periodically())
+
+
+@driver.on_shutdown
+async def _():
+    if _evict_task:
+        _evict_task.cancel()
@@ -1,10 +1,13 @@
 import abc
-from typing import Any, Generic, TypeVar, Union
+import copy
+from collections.abc import Iterable, Sequence
+from typing import Any, Generic, Optional, TypeVar, Union
 
 from nonebot.adapters import Bot, Message
 from nonebot.compat import type_validate_python
 from nonebot_plugin_uninfo import SupportAdapter
 
+from .config import plugin_config
 from .exception import AdapterNotInstalled, AdapterNotSupported
 
 JsonMsg = list[dict[str, Any]]
@@ -27,15 +30,58 @@ class MessageDeserializer(abc.ABC, Generic[TM]):
     def deserialize(cls, msg: JsonMsg) -> TM:
         return type_validate_python(cls.get_message_class(), msg)
 
+    @classmethod
+    def deserialize_many(cls, msgs: Sequence[JsonMsg]) -> list[TM]:
+        """批量反序列化
+
+        `Message` 的校验会为每个消息段单独构建校验器，
+        这里将所有消息的消息段一次性校验后再组装为消息，结果与逐条调用 `deserialize` 相同
+        """
+        message_class = cls.get_message_class()
+        segments = type_validate_python(
+            list[message_class.get_segment_class()],
+            [seg for msg in msgs for seg in msg],
+        )
+        messages: list[TM] = []
+        start = 0
+        for msg in msgs:
+            end = start + len(msg)
+            messages.append(message_class(segments[start:end]))
+            start = end
+        return messages
+
+    @classmethod
+    def construct(cls, msg: JsonMsg) -> TM:
+        """直接构造消息，不进行校验
+
+        用于由 `MessageSerializer.serialize` 生成的可信数据，数据格式不符时回退到 `deserialize`
+        """
+        message_class = cls.get_message_class()
+        segment_class = message_class.get_segment_class()
+        try:
+            segments = [segment_class(seg["type"], seg["data"]) for seg in msg]
+        except (KeyError, TypeError):
+            return cls.deserialize(msg)
+        message = message_class()
+        # 消息段类型已确定，跳过 `Message.append` 中的类型判断
+        list.extend(message, segments)
+        return message
+
+    @classmethod
+    def construct_many(cls, msgs: Sequence[JsonMsg]) -> list[TM]:
+        return [cls.construct(msg) for msg in msgs]
+
 
 _serializers: dict[SupportAdapter, type[MessageSerializer]] = {}
 _deserializers: dict[SupportAdapter, type[MessageDeserializer]] = {}
+_adapter_types: dict[str, SupportAdapter] = {
+    adapter.value: adapter for adapter in SupportAdapter
+}
 
 
 def get_adapter_type(bot_type: str) -> SupportAdapter:
-    for adapter in SupportAdapter:
-        if bot_type == adapter.value:
-            return adapter
+    if adapter := _adapter_types.get(bot_type):
+        return adapter
 
     raise AdapterNotSupported(bot_type)
 
@@ -73,10 +119,82 @@ def serialize_message(
 
 
 def deserialize_message(
-    bot_type: Union[Bot, SupportAdapter, str], msg: JsonMsg
+    bot_type: Union[Bot, SupportAdapter, str],
+    msg: JsonMsg,
+    validate: Optional[bool] = None,
 ) -> Message:
+    """反序列化消息
+
+    `validate` 为空时按 `chatrecorder_message_validation` 配置决定是否完整校验
+    """
     if isinstance(bot_type, Bot):
         bot_type = bot_type.type
     if isinstance(bot_type, str):
         bot_type = get_adapter_type(bot_type)
-    return get_deserializer(bot_type).deserialize(msg)
+    if validate is None:
+        validate = plugin_config.chatrecorder_message_validation
+    deserializer = get_deserializer(bot_type)
+    return deserializer.deserialize(msg) if validate else deserializer.construct(msg)
+
+
+def deserialize_messages(
+    msgs: Iterable[tuple[Union[Bot, SupportAdapter, str], JsonMsg]],
+    validate: Optional[bool] = None,
+) -> list[Message]:
+    """批量反序列化消息
+
+    按适配器分组，每组只查找一次反序列化器并一次性处理，返回的消息与传入的顺序一致；
+    `validate` 为空时按 `chatrecorder_message_validation` 配置决定是否完整校验
+    """
+    if validate is None:
+        validate = plugin_config.chatrecorder_message_validation
+
+    groups: dict[Union[SupportAdapter, str], tuple[list[int], list[JsonMsg]]] = {}
+    count = 0
+    for bot_type, msg in msgs:
+        if isinstance(bot_type, Bot):
+            bot_type = bot_type.type
+        indexes, group = groups.setdefault(bot_type, ([], []))
+        indexes.append(count)
+        group.append(msg)
+        count += 1
+
+    results: list[Any] = [None] * count
+    for bot_type, (indexes, group) in groups.items():
+        if isinstance(bot_type, str):
+            bot_type = get_adapter_type(bot_type)
+        deserializer = get_deserializer(bot_type)
+        messages = (
+            deserializer.deserialize_many(group)
+            if validate
+            else deserializer.construct_many(group)
+        )
+        for index, message in zip(indexes, messages):
+            results[index] = message
+    return results
+
+
+def _copy_data(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _copy_data(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy_data(v) for v in value]
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    return copy.deepcopy(value)
+
+
+def copy_json_msg(msg: JsonMsg) -> JsonMsg:
+    """复制序列化后的消息，与 `copy_message` 相同，用于从缓存中读取消息记录"""
+    return _copy_data(msg)
+
+
+def copy_message(msg: TM) -> TM:
+    """复制消息及其中的消息段，消息段数据会被完整复制
+
+    消息段数据中的字典、列表逐层复制，其他类型的值使用 `copy.deepcopy`；
+    比 `Message.copy` 的深复制快得多，用于从缓存中读取消息
+    """
+    message = type(msg)()
+    list.extend(message, [type(seg)(seg.type, _copy_data(seg.data)) for seg in msg])
+    return message
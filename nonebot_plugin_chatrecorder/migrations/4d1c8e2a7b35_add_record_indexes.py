@@ -0,0 +1,61 @@
+"""add_record_indexes
+
+迁移 ID: 4d1c8e2a7b35
+父迁移: 9e0d9e74fc48
+创建时间: 2026-10-18 15:20:41.836214
+
+"""
+
+from __future__ import annotations
+
+from collections.abc import Sequence
+
+from alembic import op
+
+revision: str = "4d1c8e2a7b35"
+down_revision: str | Sequence[str] | None = "9e0d9e74fc48"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+TABLE_NAME = "nonebot_plugin_chatrecorder_messagerecord_v2"
+INDEXES = [
+    ("ix_chatrecorder_record_session_time", ["session_persist_id", "time"]),
+    ("ix_chatrecorder_record_time", ["time"]),
+    ("ix_chatrecorder_record_message_id", ["message_id"]),
+]
+
+
+def upgrade(name: str = "") -> None:
+    if name:
+        return
+    if op.get_context().dialect.name == "postgresql":
+        # 在 PostgreSQL 中并发创建索引，避免长时间锁表；
+        # CREATE INDEX CONCURRENTLY 不能在事务中执行
+        with op.get_context().autocommit_block():
+            for index_name, columns in INDEXES:
+                op.create_index(
+                    op.f(index_name),
+                    TABLE_NAME,
+                    columns,
+                    unique=False,
+                    postgresql_concurrently=True,
+                )
+    else:
+        for index_name, columns in INDEXES:
+            op.create_index(op.f(index_name), TABLE_NAME, columns, unique=False)
+
+
+def downgrade(name: str = "") -> None:
+    if name:
+        return
+    if op.get_context().dialect.name == "postgresql":
+        with op.get_context().autocommit_block():
+            for index_name, _ in reversed(INDEXES):
+                op.drop_index(
+                    op.f(index_name),
+                    table_name=TABLE_NAME,
+                    postgresql_concurrently=True,
+                )
+    else:
+        for index_name, _ in reversed(INDEXES):
+            op.drop_index(op.f(index_name), table_name=TABLE_NAME)
@@ -0,0 +1,57 @@
+"""index_record_message_id_by_session
+
+迁移 ID: 7b2f5c9e1d04
+父迁移: 4d1c8e2a7b35
+创建时间: 2026-10-18 18:42:09.271530
+
+"""
+
+from __future__ import annotations
+
+from collections.abc import Sequence
+
+from alembic import op
+
+revision: str = "7b2f5c9e1d04"
+down_revision: str | Sequence[str] | None = "4d1c8e2a7b35"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+TABLE_NAME = "nonebot_plugin_chatrecorder_messagerecord_v2"
+OLD_INDEX = ("ix_chatrecorder_record_message_id", ["message_id"])
+NEW_INDEX = (
+    "ix_chatrecorder_record_message_session",
+    ["message_id", "session_persist_id"],
+)
+
+
+def replace_index(old: tuple[str, list[str]], new: tuple[str, list[str]]) -> None:
+    if op.get_context().dialect.name == "postgresql":
+        # 在 PostgreSQL 中并发创建索引，避免长时间锁表；
+        # CREATE INDEX CONCURRENTLY 不能在事务中执行
+        with op.get_context().autocommit_block():
+            op.create_index(
+                op.f(new[0]),
+                TABLE_NAME,
+                new[1],
+                unique=False,
+                postgresql_concurrently=True,
+            )
+            op.drop_index(
+                op.f(old[0]), table_name=TABLE_NAME, postgresql_concurrently=True
+            )
+    else:
+        op.create_index(op.f(new[0]), TABLE_NAME, new[1], unique=False)
+        op.drop_index(op.f(old[0]), table_name=TABLE_NAME)
+
+
+def upgrade(name: str = "") -> None:
+    if name:
+        return
+    replace_index(OLD_INDEX, NEW_INDEX)
+
+
+def downgrade(name: str = "") -> None:
+    if name:
+        return
+    replace_index(NEW_INDEX, OLD_INDEX)
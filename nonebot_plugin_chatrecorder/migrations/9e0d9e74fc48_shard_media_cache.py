@@ -0,0 +1,156 @@
+"""shard_media_cache
+
+迁移 ID: 9e0d9e74fc48
+父迁移: bc43ce947963
+创建时间: 2026-10-18 14:02:37.513062
+
+"""
+
+from __future__ import annotations
+
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any
+
+import sqlalchemy as sa
+from alembic import op
+from nonebot.log import logger
+from nonebot_plugin_localstore import get_cache_dir
+
+revision: str = "9e0d9e74fc48"
+down_revision: str | Sequence[str] | None = "bc43ce947963"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+FILE_URI_PREFIX = "file:///"
+CACHE_SUFFIX = ".cache"
+
+
+def get_cache_dirs() -> list[Path]:
+    cache_dir = get_cache_dir("nonebot_plugin_chatrecorder")
+    return [cache_dir / "images", cache_dir / "records", cache_dir / "videos"]
+
+
+def sharded_path(cache_dir: Path, name: str) -> Path:
+    return cache_dir / name[:2] / name[2:4] / name
+
+
+def move_files(cache_dirs: list[Path], to_sharded: bool) -> int:
+    count = 0
+    for cache_dir in cache_dirs:
+        if not cache_dir.is_dir():
+            continue
+        pattern = f"*{CACHE_SUFFIX}" if to_sharded else f"*/*/*{CACHE_SUFFIX}"
+        for path in list(cache_dir.glob(pattern)):
+            if not path.is_file():
+                continue
+            new_path = (
+                sharded_path(cache_dir, path.name)
+                if to_sharded
+                else cache_dir / path.name
+            )
+            new_path.parent.mkdir(parents=True, exist_ok=True)
+            path.replace(new_path)
+            count += 1
+        if not to_sharded:
+            # 删除空的分片目录
+            for shard_dir in sorted(cache_dir.glob("*/*"), reverse=True):
+                if shard_dir.is_dir() and not any(shard_dir.iterdir()):
+                    shard_dir.rmdir()
+            for shard_dir in list(cache_dir.glob("*")):
+                if shard_dir.is_dir() and not any(shard_dir.iterdir()):
+                    shard_dir.rmdir()
+    return count
+
+
+def rewrite_uri(uri: str, cache_dirs: list[Path], to_sharded: bool) -> str:
+    path = Path(uri[len(FILE_URI_PREFIX) :])
+    name = path.name
+    if not name.endswith(CACHE_SUFFIX):
+        return uri
+
+    for cache_dir in cache_dirs:
+        base = cache_dir.resolve()
+        if to_sharded and path.parent == base:
+            return f"{FILE_URI_PREFIX}{sharded_path(base, name)}"
+        if not to_sharded and path == sharded_path(base, name):
+            return f"{FILE_URI_PREFIX}{base / name}"
+    return uri
+
+
+def rewrite_message(
+    message: list[dict[str, Any]], cache_dirs: list[Path], to_sharded: bool
+) -> bool:
+    changed = False
+    for seg in message:
+        if seg.get("type") not in ("image", "record", "video"):
+            continue
+        data = seg.get("data")
+        if not isinstance(data, dict):
+            continue
+        file = data.get("file")
+        if not isinstance(file, str) or not file.startswith(FILE_URI_PREFIX):
+            continue
+        new_file = rewrite_uri(file, cache_dirs, to_sharded)
+        if new_file != file:
+            data["file"] = new_file
+            changed = True
+    return changed
+
+
+def data_migrate(to_sharded: bool) -> None:
+    cache_dirs = get_cache_dirs()
+    count = move_files(cache_dirs, to_sharded)
+    if count:
+        logger.info(f"chatrecorder: 已移动 {count} 个缓存文件")
+
+    conn = op.get_bind()
+    table = sa.table(
+        "nonebot_plugin_chatrecorder_messagerecord_v2",
+        sa.column("id", sa.Integer),
+        sa.column("message", sa.JSON),
+    )
+
+    migration_limit = 10000  # 每次迁移的数据量为 10000 条
+    last_id = -1
+    updated = 0
+    while True:
+        statement = (
+            sa.select(table.c.id, table.c.message)
+            .where(table.c.id > last_id)
+            .where(sa.cast(table.c.message, sa.Text).like(f"%{CACHE_SUFFIX}%"))
+            .order_by(table.c.id)
+            .limit(migration_limit)
+        )
+        records = conn.execute(statement).all()
+        if not records:
+            break
+        last_id = records[-1][0]
+
+        params = [
+            {"_id": record_id, "_message": message}
+            for record_id, message in records
+            if isinstance(message, list)
+            and rewrite_message(message, cache_dirs, to_sharded)
+        ]
+        if params:
+            conn.execute(
+                sa.update(table)
+                .where(table.c.id == sa.bindparam("_id"))
+                .values(message=sa.bindparam("_message")),
+                params,
+            )
+            updated += len(params)
+            logger.info(f"chatrecorder: 已更新 {updated} 条消息记录中的缓存文件路径")
+
+
+def upgrade(name: str = "") -> None:
+    if name:
+        return
+    data_migrate(to_sharded=True)
+
+
+def downgrade(name: str = "") -> None:
+    if name:
+        return
+    data_migrate(to_sharded=False)
@@ -0,0 +1,74 @@
+import json
+from collections import OrderedDict, deque
+from typing import Optional
+
+from nonebot_plugin_uninfo import Session
+
+from .cache import SceneKey, scene_key
+from .config import plugin_config
+from .message import JsonMsg
+from .model import MessageRecord
+
+
+class RecentMessages:
+    """按事件场景保存最近记录的消息
+
+    每个事件场景最多保存 `scene_size` 条消息，所有事件场景合计最多保存 `max_size` 条，
+    超出时清理最久未访问的事件场景
+
+    消息按记录的顺序保存，包括尚未写入数据库的消息；
+    `scene_size` 或 `max_size` 小于等于 0 时不保存任何消息
+    """
+
+    def __init__(self, scene_size: int, max_size: int) -> None:
+        self.scene_size = scene_size
+        self.max_size = max_size
+        self.hits = 0
+        """ 命中次数 """
+        self.misses = 0
+        """ 未命中次数 """
+        self._scenes: OrderedDict[SceneKey, deque[JsonMsg]] = OrderedDict()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, session: Session, record: MessageRecord) -> None:
+        """保存消息记录中的消息"""
+        if self.scene_size <= 0 or self.max_size <= 0:
+            return
+
+        key = scene_key(session)
+        if (messages := self._scenes.get(key)) is None:
+            messages = self._scenes[key] = deque(maxlen=self.scene_size)
+        self._scenes.move_to_end(key)
+        if len(messages) == messages.maxlen:
+            self._size -= 1
+        # 复制一份与从数据库中读取时相同的数据，避免受到原消息修改的影响
+        messages.append(json.loads(json.dumps(record.message)))
+        self._size += 1
+
+        while self._size > self.max_size:
+            _, evicted = self._scenes.popitem(last=False)
+            self._size -= len(evicted)
+
+    def get(self, session: Session, n: int) -> Optional[list[JsonMsg]]:
+        """获取事件场景中最近的 `n` 条消息，从旧到新排列；保存的消息不足 `n` 条时返回 `None`"""
+        key = scene_key(session)
+        messages = self._scenes.get(key)
+        if messages is None or len(messages) < n:
+            self.misses += 1
+            return None
+        self._scenes.move_to_end(key)
+        self.hits += 1
+        return list(messages)[len(messages) - n :]
+
+    def clear(self) -> None:
+        self._scenes.clear()
+        self._size = 0
+
+
+recent_messages = RecentMessages(
+    scene_size=plugin_config.chatrecorder_recent_scene_size,
+    max_size=plugin_config.chatrecorder_recent_max_size,
+)
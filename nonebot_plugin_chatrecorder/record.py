@@ -1,20 +1,93 @@
-from collections.abc import Iterable, Sequence
+import base64
+import json
+from collections.abc import AsyncIterator, Callable, Hashable, Iterable, Sequence
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Literal, Optional, Union
+from typing import Any, Literal, Optional, TypeVar, Union
 
 from nonebot.adapters import Message
 from nonebot_plugin_orm import get_session
 from nonebot_plugin_uninfo import SceneType, Session, SupportAdapter, SupportScope
 from nonebot_plugin_uninfo.orm import BotModel, SceneModel, SessionModel, UserModel
-from sqlalchemy import or_, select
+from sqlalchemy import Integer, Row, Select, and_, bindparam, func, or_, select
+from sqlalchemy.orm import InstrumentedAttribute, defer
 from sqlalchemy.sql import ColumnElement
 
-from .message import deserialize_message
+from .cache import (
+    LRUCache,
+    message_cache,
+    record_cache,
+    scene_key,
+    session_generation,
+)
+from .config import plugin_config
+from .message import JsonMsg, copy_json_msg, copy_message, deserialize_messages
 from .model import MessageRecord
+from .recent import recent_messages
+from .sql import LARGE_IN_THRESHOLD, Bucket, in_values, time_bucket
 from .utils import adapter_value, remove_timezone, scene_type_value, scope_value
 
+Order = Literal["asc", "desc"]
+GroupBy = Literal["user", "scene", "bot", "adapter", "type"]
+RowField = Literal[
+    "id",
+    "session_persist_id",
+    "time",
+    "type",
+    "message_id",
+    "message",
+    "plain_text",
+    "self_id",
+    "adapter",
+    "scope",
+    "scene_type",
+    "scene_id",
+    "user_id",
+]
+SelectT = TypeVar("SelectT", bound=Select)
 
-def filter_statement(
+STATEMENT_CACHE_SIZE = 256
+SESSION_IDS_CACHE_SIZE = 256
+SESSION_IDS_LIMIT = LARGE_IN_THRESHOLD
+""" 符合条件的事件场景或会话超过此数量时，不再按持久化 id 筛选，而是连接会话相关的表 """
+
+_EQ_FILTERS: dict[str, InstrumentedAttribute] = {
+    "session_self_id": BotModel.self_id,
+    "session_adapter": BotModel.adapter,
+    "session_scope": BotModel.scope,
+    "session_scene_id": SceneModel.scene_id,
+    "session_scene_type": SceneModel.scene_type,
+    "session_user_id": UserModel.user_id,
+}
+_IN_FILTERS: dict[str, tuple[InstrumentedAttribute, bool]] = {
+    "self_ids": (BotModel.self_id, False),
+    "adapters": (BotModel.adapter, False),
+    "scopes": (BotModel.scope, False),
+    "scene_types": (SceneModel.scene_type, False),
+    "scene_ids": (SceneModel.scene_id, False),
+    "user_ids": (UserModel.user_id, False),
+    "exclude_self_ids": (BotModel.self_id, True),
+    "exclude_adapters": (BotModel.adapter, True),
+    "exclude_scopes": (BotModel.scope, True),
+    "exclude_scene_types": (SceneModel.scene_type, True),
+    "exclude_scene_ids": (SceneModel.scene_id, True),
+    "exclude_user_ids": (UserModel.user_id, True),
+    "types": (MessageRecord.type, False),
+    "message_ids": (MessageRecord.message_id, False),
+    "session_ids": (MessageRecord.session_persist_id, False),
+}
+SESSION_FILTERS = frozenset(_EQ_FILTERS) | frozenset(
+    name
+    for name, (column, _) in _IN_FILTERS.items()
+    if column.class_ is not MessageRecord
+)
+""" 筛选会话相关字段的条件名称 """
+_USER_FILTERS = frozenset(("session_user_id", "user_ids", "exclude_user_ids"))
+_SCENE_PARAMS = frozenset(("bot_persist_ids", "scene_persist_ids"))
+_PAGINATION_PARAMS = frozenset(("cursor_time", "cursor_id", "limit"))
+
+
+def filter_values(
     *,
     session: Optional[Session] = None,
     filter_self_id: bool = True,
@@ -37,8 +110,11 @@ def filter_statement(
     time_start: Optional[datetime] = None,
     time_stop: Optional[datetime] = None,
     types: Optional[Iterable[Literal["message", "message_sent"]]] = None,
-) -> list[ColumnElement[bool]]:
-    """筛选消息记录
+    message_ids: Optional[Iterable[str]] = None,
+) -> dict[str, Any]:
+    """获取筛选消息记录的条件
+
+    返回筛选条件的名称与对应的值，名称同时也是查询语句中绑定参数的名称
 
     参数:
       * ``session: Optional[Session]``: 会话模型，传入时会根据 `session` 中的字段筛选
@@ -62,141 +138,1089 @@ def filter_statement(
       * ``time_start: Optional[datetime]``: 起始时间，为空表示不限制起始时间（传入带时区的时间或 UTC 时间）
       * ``time_stop: Optional[datetime]``: 结束时间，为空表示不限制结束时间（传入带时区的时间或 UTC 时间）
       * ``types: Optional[Iterable[Literal["message", "message_sent"]]]``: 消息事件类型列表，为空表示所有类型
+      * ``message_ids: Optional[Iterable[str]]``: 消息 id 列表，为空表示所有 id
 
     返回值:
-      * ``List[ColumnElement[bool]]``: 筛选语句
+      * ``Dict[str, Any]``: 筛选条件的名称与值
     """
 
-    whereclause: list[ColumnElement[bool]] = []
+    values: dict[str, Any] = {}
     if session:
         if filter_self_id:
-            whereclause.append(BotModel.self_id == session.self_id)
+            values["session_self_id"] = session.self_id
         if filter_adapter:
-            whereclause.append(BotModel.adapter == adapter_value(session.adapter))
+            values["session_adapter"] = adapter_value(session.adapter)
         if filter_scope:
-            whereclause.append(BotModel.scope == scope_value(session.scope))
+            values["session_scope"] = scope_value(session.scope)
         if filter_scene:
-            whereclause.append(SceneModel.scene_id == session.scene.id)
-            whereclause.append(SceneModel.scene_type == session.scene.type.value)
+            values["session_scene_id"] = session.scene.id
+            values["session_scene_type"] = session.scene.type.value
         if filter_user:
-            whereclause.append(UserModel.user_id == session.user.id)
+            values["session_user_id"] = session.user.id
+
+    def unique(items: Iterable[Any]) -> list[Any]:
+        return list(dict.fromkeys(items))
 
     if self_ids:
-        whereclause.append(or_(*[BotModel.self_id == self_id for self_id in self_ids]))
+        values["self_ids"] = unique(self_ids)
     if adapters:
-        whereclause.append(
-            or_(*[BotModel.adapter == adapter_value(adapter) for adapter in adapters])
-        )
+        values["adapters"] = unique(adapter_value(adapter) for adapter in adapters)
     if scopes:
-        whereclause.append(
-            or_(*[BotModel.scope == scope_value(scope) for scope in scopes])
-        )
+        values["scopes"] = unique(scope_value(scope) for scope in scopes)
     if scene_types:
-        whereclause.append(
-            or_(
-                *[
-                    SceneModel.scene_type == scene_type_value(scene_type)
-                    for scene_type in scene_types
-                ]
-            )
+        values["scene_types"] = unique(
+            scene_type_value(scene_type) for scene_type in scene_types
         )
     if scene_ids:
-        whereclause.append(
-            or_(*[SceneModel.scene_id == scene_id for scene_id in scene_ids])
-        )
+        values["scene_ids"] = unique(scene_ids)
     if user_ids:
-        whereclause.append(or_(*[UserModel.user_id == user_id for user_id in user_ids]))
+        values["user_ids"] = unique(user_ids)
     if exclude_self_ids:
-        for self_id in exclude_self_ids:
-            whereclause.append(BotModel.self_id != self_id)
+        values["exclude_self_ids"] = unique(exclude_self_ids)
     if exclude_adapters:
-        for adapter in exclude_adapters:
-            whereclause.append(BotModel.adapter != adapter_value(adapter))
+        values["exclude_adapters"] = unique(
+            adapter_value(adapter) for adapter in exclude_adapters
+        )
     if exclude_scopes:
-        for scope in exclude_scopes:
-            whereclause.append(BotModel.scope != scope_value(scope))
+        values["exclude_scopes"] = unique(
+            scope_value(scope) for scope in exclude_scopes
+        )
     if exclude_scene_types:
-        for scene_type in exclude_scene_types:
-            whereclause.append(SceneModel.scene_type != scene_type_value(scene_type))
+        values["exclude_scene_types"] = unique(
+            scene_type_value(scene_type) for scene_type in exclude_scene_types
+        )
     if exclude_scene_ids:
-        for scene_id in exclude_scene_ids:
-            whereclause.append(SceneModel.scene_id != scene_id)
+        values["exclude_scene_ids"] = unique(exclude_scene_ids)
     if exclude_user_ids:
-        for user_id in exclude_user_ids:
-            whereclause.append(UserModel.user_id != user_id)
+        values["exclude_user_ids"] = unique(exclude_user_ids)
     if time_start:
-        whereclause.append(MessageRecord.time >= remove_timezone(time_start))
+        values["time_start"] = remove_timezone(time_start)
     if time_stop:
-        whereclause.append(MessageRecord.time <= remove_timezone(time_stop))
+        values["time_stop"] = remove_timezone(time_stop)
     if types:
-        whereclause.append(or_(*[MessageRecord.type == type for type in types]))
-    return whereclause
+        values["types"] = unique(types)
+    if message_ids:
+        values["message_ids"] = unique(message_ids)
+    return values
+
+
+def filter_clause(name: str, value: Any) -> ColumnElement[bool]:
+    """根据筛选条件的名称与值生成筛选语句，值以同名的绑定参数传入"""
+    if name in _IN_FILTERS:
+        column, negate = _IN_FILTERS[name]
+        return in_values(column, value, negate=negate, key=name)
+    if name == "time_start":
+        return MessageRecord.time >= bindparam(name, value)
+    if name == "time_stop":
+        return MessageRecord.time <= bindparam(name, value)
+    if name in _EQ_FILTERS:
+        return _EQ_FILTERS[name] == bindparam(name, value)
+    raise ValueError(f"不支持的筛选条件: {name!r}")
 
 
-async def get_message_records(**kwargs) -> Sequence[MessageRecord]:
+def filter_statement(**kwargs) -> list[ColumnElement[bool]]:
+    """筛选消息记录
+
+    参数:
+      * ``**kwargs``: 筛选参数，具体查看 `filter_values` 中的定义
+
+    返回值:
+      * ``List[ColumnElement[bool]]``: 筛选语句
+    """
+    return [
+        filter_clause(name, value) for name, value in filter_values(**kwargs).items()
+    ]
+
+
+def join_session_models(statement: SelectT) -> SelectT:
+    """连接消息记录对应的会话、bot、事件场景和用户表，以便按会话信息筛选
+
+    只连接查询语句中用到的表，如仅按时间筛选时不连接任何表；
+    需在添加筛选条件和查询的列之后调用
+    """
+    froms = set(statement.get_final_froms())
+    models = [
+        model for model in (BotModel, SceneModel, UserModel) if model.__table__ in froms
+    ]
+    if MessageRecord.__table__ in froms and (models or SessionModel.__table__ in froms):
+        statement = statement.join_from(
+            MessageRecord,
+            SessionModel,
+            SessionModel.id == MessageRecord.session_persist_id,
+        )
+    if BotModel in models:
+        statement = statement.join_from(
+            SessionModel, BotModel, BotModel.id == SessionModel.bot_persist_id
+        )
+    if SceneModel in models:
+        statement = statement.join_from(
+            SessionModel, SceneModel, SceneModel.id == SessionModel.scene_persist_id
+        )
+    if UserModel in models:
+        statement = statement.join_from(
+            SessionModel, UserModel, UserModel.id == SessionModel.user_persist_id
+        )
+    return statement
+
+
+statement_cache: LRUCache[Hashable, Select] = LRUCache(STATEMENT_CACHE_SIZE)
+""" 查询语句缓存
+
+键为查询语句的结构，即查询的内容、用到的筛选条件名称、排序方式等；
+筛选条件的值均为绑定参数，执行时传入，因此结构相同的查询可以共用同一条查询语句，
+SQLAlchemy 也会复用编译后的语句
+"""
+
+
+def cached_statement(
+    shape: Hashable,
+    params: dict[str, Any],
+    build: Callable[[dict[str, Any]], SelectT],
+) -> tuple[SelectT, dict[str, Any]]:
+    """获取结构为 `shape` 的查询语句，不存在时调用 `build` 生成
+
+    参数中含有较长的列表时，列表的值会直接写入语句中（见 `in_values`），这样的语句不会被缓存
+
+    返回值:
+      * ``Tuple[Select, Dict[str, Any]]``: 查询语句，以及执行时需传入的参数
+    """
+    large = {
+        name
+        for name, value in params.items()
+        if isinstance(value, list) and len(value) > LARGE_IN_THRESHOLD
+    }
+    if large:
+        statement = build(params)
+        params = {name: value for name, value in params.items() if name not in large}
+        return statement, params
+
+    statement = statement_cache.get(shape)
+    if statement is None:
+        statement = build(params)
+        statement_cache.set(shape, statement)
+    return statement, params  # type: ignore
+
+
+SessionIdsKey = tuple[tuple[str, Hashable], ...]
+
+session_ids_cache: LRUCache[
+    SessionIdsKey, tuple[Optional[dict[str, list[int]]], int]
+] = LRUCache(SESSION_IDS_CACHE_SIZE)
+""" 会话筛选条件对应的持久化 id 缓存
+
+值为 `resolve_session_filters` 的结果，以及缓存时 `session_generation` 的版本号
+"""
+
+
+def _hashable(value: Any) -> Hashable:
+    if isinstance(value, (list, tuple, set)):
+        return tuple(value)
+    return value
+
+
+def _scene_sessions_clause(params: dict[str, Any]) -> ColumnElement[bool]:
+    """按事件场景持久化 id 筛选消息记录，事件场景中的会话在子查询中展开"""
+    # 事件场景只属于一个 bot，同时筛选 bot 持久化 id 不影响结果，
+    # 只是为了利用会话表 `(bot_persist_id, scene_persist_id, user_persist_id)` 的唯一索引
+    sessions = select(SessionModel.id).where(
+        in_values(
+            SessionModel.bot_persist_id,
+            params["bot_persist_ids"],
+            key="bot_persist_ids",
+        ),
+        in_values(
+            SessionModel.scene_persist_id,
+            params["scene_persist_ids"],
+            key="scene_persist_ids",
+        ),
+    )
+    # 外层查询连接了会话表时，子查询不应与之关联
+    return MessageRecord.session_persist_id.in_(sessions.correlate(None))
+
+
+async def resolve_session_filters(
+    filters: dict[str, Any],
+) -> Optional[dict[str, list[int]]]:
+    """将会话相关的筛选条件转换为按持久化 id 筛选的条件
+
+    不筛选用户时，查询符合条件的事件场景，返回 `bot_persist_ids` 与 `scene_persist_ids`，
+    查询消息记录时在子查询中展开为事件场景中的会话，大群中新增成员不影响结果；
+    筛选用户时，查询符合条件的会话，返回 `session_ids`
+
+    结果会被缓存；`session_generation` 的版本号变化后，只检查之后获取的会话，
+    记录不足时重新查询
+
+    参数:
+      * ``filters: Dict[str, Any]``: 会话相关的筛选条件，由 `filter_values` 生成
+
+    返回值:
+      * ``Optional[Dict[str, List[int]]]``: 替换会话筛选条件的参数，
+        事件场景或会话的数量超过 `SESSION_IDS_LIMIT` 时为 `None`
+    """
+    key: SessionIdsKey = tuple(
+        (name, _hashable(value)) for name, value in filters.items()
+    )
+    by_scene = not any(name in _USER_FILTERS for name in filters)
+    generation = session_generation.value
+    params = dict(filters)
+    resolved: Optional[dict[str, list[int]]] = None
+    if cached := session_ids_cache.get(key):
+        resolved, cached_generation = cached
+        if cached_generation == generation:
+            return resolved
+        if (new_ids := session_generation.since(cached_generation)) is not None:
+            if resolved is None:
+                # 新获取的会话不会使符合条件的数量减少
+                session_ids_cache.set(key, (None, generation))
+                return None
+            if not new_ids:
+                session_ids_cache.set(key, (resolved, generation))
+                return resolved
+            params["new_session_ids"] = new_ids
+        else:
+            resolved = None
+    if "new_session_ids" not in params:
+        # 多查询一条以判断是否超过数量上限
+        params["session_id_limit"] = SESSION_IDS_LIMIT + 1
+
+    def build(params: dict[str, Any]) -> Select:
+        whereclause = [
+            filter_clause(name, value)
+            for name, value in params.items()
+            if name in SESSION_FILTERS
+        ]
+        if "new_session_ids" in params:
+            whereclause.append(
+                in_values(
+                    SessionModel.id, params["new_session_ids"], key="new_session_ids"
+                )
+            )
+            columns = (
+                (SessionModel.bot_persist_id, SessionModel.scene_persist_id)
+                if by_scene
+                else (SessionModel.id,)
+            )
+            return join_session_models(select(*columns).where(*whereclause))
+        if by_scene:
+            statement = select(SceneModel.bot_persist_id, SceneModel.id).where(
+                *whereclause
+            )
+            if BotModel.__table__ in set(statement.get_final_froms()):
+                statement = statement.join_from(
+                    SceneModel, BotModel, BotModel.id == SceneModel.bot_persist_id
+                )
+        else:
+            statement = join_session_models(select(SessionModel.id).where(*whereclause))
+        return statement.limit(
+            bindparam("session_id_limit", params["session_id_limit"], type_=Integer)
+        )
+
+    async with get_session() as db_session:
+        statement, params = cached_statement(
+            ("session_ids", by_scene, tuple(params)), params, build
+        )
+        rows = (await db_session.execute(statement, params)).all()
+
+    def unique(old: list[int], new: Iterable[int]) -> list[int]:
+        return list(dict.fromkeys([*old, *new]))
+
+    old = resolved or {}
+    if by_scene:
+        resolved = {
+            "bot_persist_ids": unique(
+                old.get("bot_persist_ids", []), (row[0] for row in rows)
+            ),
+            "scene_persist_ids": unique(
+                old.get("scene_persist_ids", []), (row[1] for row in rows)
+            ),
+        }
+        count = len(resolved["scene_persist_ids"])
+    else:
+        resolved = {
+            "session_ids": unique(old.get("session_ids", []), (row[0] for row in rows))
+        }
+        count = len(resolved["session_ids"])
+    if count > SESSION_IDS_LIMIT:
+        # 不缓存持久化 id 列表，只记录超过了数量上限
+        session_ids_cache.set(key, (None, generation))
+        return None
+    session_ids_cache.set(key, (resolved, generation))
+    return resolved
+
+
+def encode_cursor(record: MessageRecord, order: Order, backward: bool) -> str:
+    """生成指向消息记录的游标
+
+    游标中包含消息记录的时间与 id、排序方向以及翻页方向，
+    `backward` 为 `True` 时表示获取该消息记录之前的一页
+    """
+    data = [record.time.isoformat(), record.id, order, backward]
+    raw = json.dumps(data, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int, Order, bool]:
+    """解析游标，返回消息记录的时间与 id、排序方向以及翻页方向"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        time, record_id, order, backward = json.loads(raw)
+        if order not in ("asc", "desc"):
+            raise ValueError(order)
+        return datetime.fromisoformat(time), int(record_id), order, bool(backward)
+    except Exception as e:
+        raise ValueError(f"无效的游标: {cursor!r}") from e
+
+
+def _order_statement(
+    statement: SelectT, params: dict[str, Any], order: Order, backward: bool
+) -> SelectT:
+    """添加按 `(time, id)` 的排序，以及 `params` 中的游标位置与数量限制"""
+    descending = order == "desc"
+    # 获取之前的一页时按相反的方向查询，再将结果反转
+    if backward:
+        descending = not descending
+    if "cursor_time" in params:
+        time = bindparam("cursor_time", params["cursor_time"])
+        record_id = bindparam("cursor_id", params["cursor_id"])
+        # 冗余的 `time <= ?` / `time >= ?` 条件使数据库可以直接在索引中定位游标位置，
+        # 否则只能从索引的一端开始扫描
+        if descending:
+            statement = statement.where(
+                MessageRecord.time <= time,
+                or_(
+                    MessageRecord.time < time,
+                    and_(MessageRecord.time == time, MessageRecord.id < record_id),
+                ),
+            )
+        else:
+            statement = statement.where(
+                MessageRecord.time >= time,
+                or_(
+                    MessageRecord.time > time,
+                    and_(MessageRecord.time == time, MessageRecord.id > record_id),
+                ),
+            )
+    if descending:
+        statement = statement.order_by(
+            MessageRecord.time.desc(), MessageRecord.id.desc()
+        )
+    else:
+        statement = statement.order_by(MessageRecord.time, MessageRecord.id)
+    if "limit" in params:
+        statement = statement.limit(bindparam("limit", params["limit"], type_=Integer))
+    return statement
+
+
+def _cursor_params(
+    order: Order, limit: Optional[int], cursor: Optional[str]
+) -> tuple[dict[str, Any], bool]:
+    params: dict[str, Any] = {}
+    backward = False
+    if cursor:
+        time, record_id, cursor_order, backward = decode_cursor(cursor)
+        if cursor_order != order:
+            raise ValueError("游标的排序方向与查询的排序方向不一致")
+        params["cursor_time"] = time
+        params["cursor_id"] = record_id
+    if limit is not None:
+        params["limit"] = limit
+    return params, backward
+
+
+async def prepare_statement(
+    key: Hashable,
+    build: Callable[[], SelectT],
+    filters: dict[str, Any],
+    *,
+    order: Optional[Order] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+) -> tuple[SelectT, dict[str, Any], bool]:
+    """生成查询消息记录的语句
+
+    开启 `chatrecorder_query_resolve_sessions` 时，
+    先在会话相关的表中查询符合条件的事件场景或会话的持久化 id（见 `resolve_session_filters`），
+    再以 `session_persist_id IN (...)` 筛选消息记录，避免连接消息记录表与会话相关的表；
+    符合条件的事件场景或会话超过 `SESSION_IDS_LIMIT` 个时仍连接会话相关的表；
+    查询语句按结构缓存，见 `statement_cache`
+
+    参数:
+      * ``key: Hashable``: 查询内容的标识，与 `build` 一一对应
+      * ``build: Callable[[], Select]``: 生成不含筛选条件的查询语句
+      * ``filters: Dict[str, Any]``: 筛选条件，由 `filter_values` 生成
+      * ``order: Optional[Literal["asc", "desc"]]``: 排序方向，为空表示不排序
+      * ``limit: Optional[int]``: 最多返回的消息记录数，为空表示不限制
+      * ``cursor: Optional[str]``: 游标
+
+    返回值:
+      * ``Tuple[Select, Dict[str, Any], bool]``: 查询语句、执行时需传入的参数，以及查询结果是否需要反转
+    """
+    params = dict(filters)
+    if plugin_config.chatrecorder_query_resolve_sessions:
+        session_filters = {
+            name: value for name, value in filters.items() if name in SESSION_FILTERS
+        }
+        # 符合条件的事件场景或会话过多时回退为连接会话相关的表
+        if (
+            session_filters
+            and (resolved := await resolve_session_filters(session_filters)) is not None
+        ):
+            for name in session_filters:
+                del params[name]
+            params.update(resolved)
+
+    backward = False
+    if order:
+        cursor_params, backward = _cursor_params(order, limit, cursor)
+        params.update(cursor_params)
+
+    def build_statement(params: dict[str, Any]) -> SelectT:
+        whereclause = [
+            filter_clause(name, value)
+            for name, value in params.items()
+            if name not in _PAGINATION_PARAMS and name not in _SCENE_PARAMS
+        ]
+        if "scene_persist_ids" in params:
+            whereclause.append(_scene_sessions_clause(params))
+        statement = join_session_models(build().where(*whereclause))
+        if order:
+            statement = _order_statement(statement, params, order, backward)
+        return statement
+
+    statement, params = cached_statement(
+        (key, tuple(params), order, backward), params, build_statement
+    )
+    return statement, params, backward
+
+
+def _records_statement(load_message: bool) -> Callable[[], Select]:
+    if load_message:
+        return lambda: select(MessageRecord)
+    # 访问未加载的 `message` 时直接报错，而不是在异步环境中隐式查询
+    return lambda: select(MessageRecord).options(
+        defer(MessageRecord.message, raiseload=True)
+    )
+
+
+@dataclass
+class MessageRecordPage:
+    """消息记录分页"""
+
+    records: list[MessageRecord]
+    """ 当前页的消息记录 """
+    next_cursor: Optional[str]
+    """ 下一页的游标，没有更多消息记录时为 `None` """
+    prev_cursor: Optional[str]
+    """ 上一页的游标，没有更多消息记录时为 `None` """
+
+
+async def get_message_records(
+    *,
+    order: Order = "asc",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    load_message: bool = True,
+    **kwargs,
+) -> Sequence[MessageRecord]:
     """获取消息记录
 
     参数:
-      * ``**kwargs``: 筛选参数，具体查看 `filter_statement` 中的定义
+      * ``order: Literal["asc", "desc"]``: 排序方向，`asc` 为从旧到新，`desc` 为从新到旧
+      * ``limit: Optional[int]``: 最多返回的消息记录数，为空表示不限制
+      * ``cursor: Optional[str]``: 游标，由 `get_message_records_page` 返回
+      * ``load_message: bool``: 是否加载 `message` 字段，为 `False` 时不读取消息内容，
+        之后访问 `message` 会引发异常
+      * ``**kwargs``: 筛选参数，具体查看 `filter_values` 中的定义
 
     返回值:
       * ``List[MessageRecord]``: 消息记录列表
     """
-    whereclause = filter_statement(**kwargs)
-    statement = (
-        select(MessageRecord)
-        .where(*whereclause)
-        .join(SessionModel, SessionModel.id == MessageRecord.session_persist_id)
-        .join(BotModel, BotModel.id == SessionModel.bot_persist_id)
-        .join(SceneModel, SceneModel.id == SessionModel.scene_persist_id)
-        .join(UserModel, UserModel.id == SessionModel.user_persist_id)
+    statement, params, backward = await prepare_statement(
+        ("records", load_message),
+        _records_statement(load_message),
+        filter_values(**kwargs),
+        order=order,
+        limit=limit,
+        cursor=cursor,
     )
     async with get_session() as db_session:
-        records = (await db_session.scalars(statement)).all()
-    return records
+        records = (await db_session.scalars(statement, params)).all()
+    return records[::-1] if backward else records
+
 
+def _messages_statement(load_message: bool) -> Callable[[], Select]:
+    if load_message:
+        return lambda: select(MessageRecord.id, BotModel.adapter, MessageRecord.message)
+    # 开启消息缓存时先不读取消息内容，见 `_load_messages`
+    return lambda: select(MessageRecord.id, BotModel.adapter)
+
+
+async def _load_messages(rows: Sequence[Row]) -> list[Message]:
+    """反序列化 `_messages_statement` 查询到的消息
+
+    开启消息缓存时优先从缓存中读取；未命中缓存的消息，
+    查询结果中含有消息内容时直接反序列化，否则再从数据库中读取；
+    返回的是缓存中消息的副本，避免调用方修改缓存中的消息
+    """
+    if message_cache.maxsize <= 0:
+        return deserialize_messages((adapter, message) for _, adapter, message in rows)
 
-async def get_messages(**kwargs) -> list[Message]:
+    results: list[Optional[Message]] = [message_cache.get(row[0]) for row in rows]
+    if missing := [index for index, result in enumerate(results) if result is None]:
+        if len(rows[0]) > 2:
+            json_msgs: dict[int, JsonMsg] = {
+                rows[index][0]: rows[index][2] for index in missing
+            }
+        else:
+            ids = [rows[index][0] for index in missing]
+            async with get_session() as db_session:
+                json_msgs = dict(
+                    (
+                        await db_session.execute(
+                            select(MessageRecord.id, MessageRecord.message).where(
+                                in_values(MessageRecord.id, ids)
+                            )
+                        )
+                    )
+                    .tuples()
+                    .all()
+                )
+        messages = deserialize_messages(
+            (rows[index][1], json_msgs.get(rows[index][0], [])) for index in missing
+        )
+        for index, message in zip(missing, messages):
+            message_cache.set(rows[index][0], message)
+            results[index] = message
+    return [copy_message(message) for message in results]  # type: ignore
+
+
+async def get_messages(
+    *,
+    order: Order = "asc",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    **kwargs,
+) -> list[Message]:
     """获取消息记录的消息列表
 
     参数:
-      * ``**kwargs``: 筛选参数，具体查看 `filter_statement` 中的定义
+      * ``order: Literal["asc", "desc"]``: 排序方向，`asc` 为从旧到新，`desc` 为从新到旧
+      * ``limit: Optional[int]``: 最多返回的消息记录数，为空表示不限制
+      * ``cursor: Optional[str]``: 游标，由 `get_message_records_page` 返回
+      * ``**kwargs``: 筛选参数，具体查看 `filter_values` 中的定义
 
     返回值:
       * ``List[Message]``: 消息列表
     """
-    whereclause = filter_statement(**kwargs)
-    statement = (
-        select(MessageRecord.message, BotModel.adapter)
-        .where(*whereclause)
-        .join(SessionModel, SessionModel.id == MessageRecord.session_persist_id)
-        .join(BotModel, BotModel.id == SessionModel.bot_persist_id)
-        .join(SceneModel, SceneModel.id == SessionModel.scene_persist_id)
-        .join(UserModel, UserModel.id == SessionModel.user_persist_id)
+    load_message = message_cache.maxsize <= 0
+    statement, params, backward = await prepare_statement(
+        ("messages", load_message),
+        _messages_statement(load_message),
+        filter_values(**kwargs),
+        order=order,
+        limit=limit,
+        cursor=cursor,
     )
     async with get_session() as db_session:
-        results = (await db_session.execute(statement)).all()
-    return [deserialize_message(result[1], result[0]) for result in results]
+        results = (await db_session.execute(statement, params)).all()
+    if backward:
+        results = results[::-1]
+    return await _load_messages(results)
 
 
-async def get_messages_plain_text(**kwargs) -> Sequence[str]:
+async def get_recent_messages(session: Session, n: int) -> list[Message]:
+    """获取会话所在事件场景（群聊、私聊等）中最近的 `n` 条消息，从旧到新排列
+
+    优先从内存中保存的最近消息中读取（见 `RecentMessages`），
+    保存的消息不足 `n` 条时从数据库中查询
+
+    参数:
+      * ``session: Session``: 会话
+      * ``n: int``: 消息数量
+
+    返回值:
+      * ``List[Message]``: 消息列表
+    """
+    if n <= 0:
+        return []
+    if (json_msgs := recent_messages.get(session, n)) is not None:
+        messages = deserialize_messages((session.adapter, msg) for msg in json_msgs)
+        # 返回副本，避免调用方修改内存中保存的消息
+        return [copy_message(message) for message in messages]
+    messages = await get_messages(
+        session=session, filter_user=False, order="desc", limit=n
+    )
+    return messages[::-1]
+
+
+async def get_messages_plain_text(
+    *,
+    order: Order = "asc",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    **kwargs,
+) -> Sequence[str]:
     """获取消息记录的纯文本消息列表
 
     参数:
-      * ``**kwargs``: 筛选参数，具体查看 `filter_statement` 中的定义
+      * ``order: Literal["asc", "desc"]``: 排序方向，`asc` 为从旧到新，`desc` 为从新到旧
+      * ``limit: Optional[int]``: 最多返回的消息记录数，为空表示不限制
+      * ``cursor: Optional[str]``: 游标，由 `get_message_records_page` 返回
+      * ``**kwargs``: 筛选参数，具体查看 `filter_values` 中的定义
 
     返回值:
       * ``List[str]``: 纯文本消息列表
     """
-    whereclause = filter_statement(**kwargs)
-    statement = (
-        select(MessageRecord.plain_text)
-        .where(*whereclause)
-        .join(SessionModel, SessionModel.id == MessageRecord.session_persist_id)
-        .join(BotModel, BotModel.id == SessionModel.bot_persist_id)
-        .join(SceneModel, SceneModel.id == SessionModel.scene_persist_id)
-        .join(UserModel, UserModel.id == SessionModel.user_persist_id)
+    statement, params, backward = await prepare_statement(
+        "plain_text",
+        lambda: select(MessageRecord.plain_text),
+        filter_values(**kwargs),
+        order=order,
+        limit=limit,
+        cursor=cursor,
+    )
+    async with get_session() as db_session:
+        records = (await db_session.scalars(statement, params)).all()
+    return records[::-1] if backward else records
+
+
+async def get_message_records_page(
+    *,
+    limit: int,
+    order: Order = "asc",
+    cursor: Optional[str] = None,
+    load_message: bool = True,
+    **kwargs,
+) -> MessageRecordPage:
+    """分页获取消息记录
+
+    按 `(time, id)` 进行游标分页，翻页时只查询当前页的消息记录；
+    翻页时需传入与获取游标时相同的筛选参数和排序方向
+
+    参数:
+      * ``limit: int``: 每页的消息记录数
+      * ``order: Literal["asc", "desc"]``: 排序方向，`asc` 为从旧到新，`desc` 为从新到旧
+      * ``cursor: Optional[str]``: 游标，为空表示获取第一页
+      * ``load_message: bool``: 是否加载 `message` 字段
+      * ``**kwargs``: 筛选参数，具体查看 `filter_values` 中的定义
+
+    返回值:
+      * ``MessageRecordPage``: 消息记录分页
+    """
+    if limit <= 0:
+        raise ValueError("limit 必须大于 0")
+
+    backward = decode_cursor(cursor)[3] if cursor else False
+    # 多查询一条消息记录，用于判断是否还有更多消息记录
+    records = list(
+        await get_message_records(
+            order=order,
+            limit=limit + 1,
+            cursor=cursor,
+            load_message=load_message,
+            **kwargs,
+        )
+    )
+    has_more = len(records) > limit
+    if has_more:
+        records = records[1:] if backward else records[:-1]
+
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+    if records:
+        if backward:
+            next_cursor = encode_cursor(records[-1], order, False)
+            if has_more:
+                prev_cursor = encode_cursor(records[0], order, True)
+        else:
+            if has_more:
+                next_cursor = encode_cursor(records[-1], order, False)
+            if cursor:
+                prev_cursor = encode_cursor(records[0], order, True)
+    return MessageRecordPage(records, next_cursor, prev_cursor)
+
+
+def _copy_record(record: MessageRecord) -> MessageRecord:
+    """复制消息记录，得到不属于任何数据库会话的新对象"""
+    return MessageRecord(
+        id=record.id,
+        session_persist_id=record.session_persist_id,
+        time=record.time,
+        type=record.type,
+        message_id=record.message_id,
+        message=copy_json_msg(record.message),
+        plain_text=record.plain_text,
+    )
+
+
+async def get_records_by_message_ids(
+    session: Session, message_ids: Iterable[str]
+) -> dict[str, MessageRecord]:
+    """获取会话所在事件场景中指定消息 id 的消息记录，用于查找回复、引用的消息
+
+    结果会被缓存（见 `record_cache`），未找到的消息 id 不会被缓存；
+    同一消息 id 有多条消息记录时返回最新的一条
+
+    参数:
+      * ``session: Session``: 会话
+      * ``message_ids: Iterable[str]``: 消息 id 列表
+
+    返回值:
+      * ``Dict[str, MessageRecord]``: 消息 id 与对应的消息记录，不包含未找到的消息 id；
+        返回的是缓存中消息记录的副本，修改后不会影响缓存，也不会写入数据库
+    """
+    key = scene_key(session)
+    message_ids = list(dict.fromkeys(message_ids))
+    records: dict[str, MessageRecord] = {}
+    missing: list[str] = []
+    for message_id in message_ids:
+        if (record := record_cache.get((key, message_id))) is not None:
+            records[message_id] = record
+        else:
+            missing.append(message_id)
+
+    if missing:
+        # 不需要排序，在结果中选出最新的一条即可
+        statement, params, _ = await prepare_statement(
+            ("records", True),
+            _records_statement(True),
+            filter_values(session=session, filter_user=False, message_ids=missing),
+        )
+        async with get_session() as db_session:
+            results = (await db_session.scalars(statement, params)).all()
+        found: dict[str, MessageRecord] = {}
+        for record in results:
+            current = found.get(record.message_id)
+            if current is None or (record.time, record.id) > (current.time, current.id):
+                found[record.message_id] = record
+        for message_id, record in found.items():
+            record_cache.set((key, message_id), record)
+        records.update(found)
+
+    return {
+        message_id: _copy_record(records[message_id])
+        for message_id in message_ids
+        if message_id in records
+    }
+
+
+async def get_record_by_message_id(
+    session: Session, message_id: str
+) -> Optional[MessageRecord]:
+    """获取会话所在事件场景中指定消息 id 的消息记录，未找到时返回 `None`
+
+    具体查看 `get_records_by_message_ids` 中的说明
+    """
+    records = await get_records_by_message_ids(session, [message_id])
+    return records.get(message_id)
+
+
+async def get_context(
+    session: Session, message_id: str, before: int = 10, after: int = 10
+) -> list[MessageRecord]:
+    """获取会话所在事件场景中指定消息 id 的消息记录及其前后的消息记录
+
+    以指定的消息记录为游标，分别按 `(time, id)` 向前、向后查询至多 `before`、`after` 条，
+    不需要读取事件场景中的其他消息记录
+
+    参数:
+      * ``session: Session``: 会话
+      * ``message_id: str``: 消息 id
+      * ``before: int``: 之前的消息记录数
+      * ``after: int``: 之后的消息记录数
+
+    返回值:
+      * ``List[MessageRecord]``: 消息记录列表，从旧到新排列，包含指定消息 id 的消息记录；
+        未找到指定消息 id 的消息记录时返回空列表
+    """
+    record = await get_record_by_message_id(session, message_id)
+    if record is None:
+        return []
+
+    filters = filter_values(session=session, filter_user=False)
+    # 先生成查询语句，生成时可能需要查询会话持久化 id，避免同时占用两个连接
+    queries: list[tuple[Order, int]] = [("desc", before), ("asc", after)]
+    statements: dict[Order, tuple[Select, dict[str, Any]]] = {}
+    for order, limit in queries:
+        if limit > 0:
+            statement, params, _ = await prepare_statement(
+                ("records", True),
+                _records_statement(True),
+                filters,
+                order=order,
+                limit=limit,
+                cursor=encode_cursor(record, order, False),
+            )
+            statements[order] = (statement, params)
+
+    results: dict[Order, Sequence[MessageRecord]] = {"desc": [], "asc": []}
+    if statements:
+        async with get_session() as db_session:
+            for order, (statement, params) in statements.items():
+                results[order] = (await db_session.scalars(statement, params)).all()
+    return [*results["desc"][::-1], record, *results["asc"]]
+
+
+_ROW_COLUMNS: dict[str, ColumnElement] = {
+    "id": MessageRecord.id,
+    "session_persist_id": MessageRecord.session_persist_id,
+    "time": MessageRecord.time,
+    "type": MessageRecord.type,
+    "message_id": MessageRecord.message_id,
+    "message": MessageRecord.message,
+    "plain_text": MessageRecord.plain_text,
+    "self_id": BotModel.self_id,
+    "adapter": BotModel.adapter,
+    "scope": BotModel.scope,
+    "scene_type": SceneModel.scene_type,
+    "scene_id": SceneModel.scene_id,
+    "user_id": UserModel.user_id,
+}
+
+
+def _rows_statement(fields: Sequence[RowField]) -> Callable[[], Select]:
+    if not fields:
+        raise ValueError("fields 不能为空")
+    columns: list[ColumnElement] = []
+    for field in fields:
+        if field not in _ROW_COLUMNS:
+            raise ValueError(f"不支持的字段: {field!r}")
+        columns.append(_ROW_COLUMNS[field].label(field))
+    return lambda: select(*columns).select_from(MessageRecord)
+
+
+async def get_message_rows(
+    *,
+    fields: Sequence[RowField],
+    order: Order = "asc",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    **kwargs,
+) -> Sequence[Row]:
+    """获取消息记录中指定的字段
+
+    只查询需要的列，返回类似具名元组的 `Row` 对象，
+    不会创建 `MessageRecord` 对象，适合只需要部分字段的大量消息记录；
+    `self_id`、`scene_id`、`user_id` 等会话信息在同一条查询中获取
+
+    参数:
+      * ``fields: Sequence[str]``: 查询的字段，可选 `MessageRecord` 的各个字段，
+        以及 `self_id`、`adapter`、`scope`、`scene_type`、`scene_id`、`user_id`
+      * ``order: Literal["asc", "desc"]``: 排序方向，`asc` 为从旧到新，`desc` 为从新到旧
+      * ``limit: Optional[int]``: 最多返回的消息记录数，为空表示不限制
+      * ``cursor: Optional[str]``: 游标，由 `get_message_records_page` 返回
+      * ``**kwargs``: 筛选参数，具体查看 `filter_values` 中的定义
+
+    返回值:
+      * ``List[Row]``: 查询结果，可按 `fields` 中的字段名访问，如 `row.plain_text`
+    """
+    statement, params, backward = await prepare_statement(
+        ("rows", tuple(fields)),
+        _rows_statement(fields),
+        filter_values(**kwargs),
+        order=order,
+        limit=limit,
+        cursor=cursor,
+    )
+    async with get_session() as db_session:
+        rows = (await db_session.execute(statement, params)).all()
+    return rows[::-1] if backward else rows
+
+
+async def iter_message_records(
+    *,
+    order: Order = "asc",
+    chunk_size: int = 1000,
+    load_message: bool = True,
+    **kwargs,
+) -> AsyncIterator[MessageRecord]:
+    """逐条获取消息记录
+
+    使用服务端游标分批读取，内存占用不随结果数量增长；
+    迭代期间会一直占用一个数据库连接，提前结束迭代时应使用 `contextlib.aclosing` 关闭
+
+    参数:
+      * ``order: Literal["asc", "desc"]``: 排序方向，`asc` 为从旧到新，`desc` 为从新到旧
+      * ``chunk_size: int``: 每次从数据库读取的消息记录数
+      * ``load_message: bool``: 是否加载 `message` 字段
+      * ``**kwargs``: 筛选参数，具体查看 `filter_values` 中的定义
+
+    返回值:
+      * ``AsyncIterator[MessageRecord]``: 消息记录
+    """
+    statement, params, _ = await prepare_statement(
+        ("records", load_message),
+        _records_statement(load_message),
+        filter_values(**kwargs),
+        order=order,
+    )
+    statement = statement.execution_options(yield_per=chunk_size)
+    async with get_session() as db_session:
+        async for record in await db_session.stream_scalars(statement, params):
+            yield record
+
+
+async def iter_messages(
+    *,
+    order: Order = "asc",
+    chunk_size: int = 1000,
+    **kwargs,
+) -> AsyncIterator[Message]:
+    """逐条获取消息记录的消息
+
+    使用服务端游标分批读取，内存占用不随结果数量增长；
+    迭代期间会一直占用一个数据库连接，提前结束迭代时应使用 `contextlib.aclosing` 关闭
+
+    参数:
+      * ``order: Literal["asc", "desc"]``: 排序方向，`asc` 为从旧到新，`desc` 为从新到旧
+      * ``chunk_size: int``: 每次从数据库读取的消息记录数
+      * ``**kwargs``: 筛选参数，具体查看 `filter_values` 中的定义
+
+    返回值:
+      * ``AsyncIterator[Message]``: 消息
+    """
+    # 迭代期间数据库连接被占用，不能再查询未命中缓存的消息，因此总是读取消息内容
+    statement, params, _ = await prepare_statement(
+        ("messages", True),
+        _messages_statement(True),
+        filter_values(**kwargs),
+        order=order,
+    )
+    statement = statement.execution_options(yield_per=chunk_size)
+    async with get_session() as db_session:
+        result = await db_session.stream(statement, params)
+        async for partition in result.partitions():
+            for message in await _load_messages(partition):
+                yield message
+
+
+async def iter_messages_plain_text(
+    *,
+    order: Order = "asc",
+    chunk_size: int = 1000,
+    **kwargs,
+) -> AsyncIterator[str]:
+    """逐条获取消息记录的纯文本消息
+
+    使用服务端游标分批读取，内存占用不随结果数量增长；
+    迭代期间会一直占用一个数据库连接，提前结束迭代时应使用 `contextlib.aclosing` 关闭
+
+    参数:
+      * ``order: Literal["asc", "desc"]``: 排序方向，`asc` 为从旧到新，`desc` 为从新到旧
+      * ``chunk_size: int``: 每次从数据库读取的消息记录数
+      * ``**kwargs``: 筛选参数，具体查看 `filter_values` 中的定义
+
+    返回值:
+      * ``AsyncIterator[str]``: 纯文本消息
+    """
+    statement, params, _ = await prepare_statement(
+        "plain_text",
+        lambda: select(MessageRecord.plain_text),
+        filter_values(**kwargs),
+        order=order,
+    )
+    statement = statement.execution_options(yield_per=chunk_size)
+    async with get_session() as db_session:
+        async for plain_text in await db_session.stream_scalars(statement, params):
+            yield plain_text
+
+
+async def iter_message_rows(
+    *,
+    fields: Sequence[RowField],
+    order: Order = "asc",
+    chunk_size: int = 1000,
+    **kwargs,
+) -> AsyncIterator[Row]:
+    """逐条获取消息记录中指定的字段
+
+    使用服务端游标分批读取，内存占用不随结果数量增长；
+    迭代期间会一直占用一个数据库连接，提前结束迭代时应使用 `contextlib.aclosing` 关闭
+
+    参数:
+      * ``fields: Sequence[str]``: 查询的字段，具体查看 `get_message_rows` 中的定义
+      * ``order: Literal["asc", "desc"]``: 排序方向，`asc` 为从旧到新，`desc` 为从新到旧
+      * ``chunk_size: int``: 每次从数据库读取的消息记录数
+      * ``**kwargs``: 筛选参数，具体查看 `filter_values` 中的定义
+
+    返回值:
+      * ``AsyncIterator[Row]``: 查询结果
+    """
+    statement, params, _ = await prepare_statement(
+        ("rows", tuple(fields)),
+        _rows_statement(fields),
+        filter_values(**kwargs),
+        order=order,
+    )
+    statement = statement.execution_options(yield_per=chunk_size)
+    async with get_session() as db_session:
+        async for row in await db_session.stream(statement, params):
+            yield row
+
+
+_GROUP_BY_COLUMNS: dict[str, ColumnElement] = {
+    "user": UserModel.user_id,
+    "scene": SceneModel.scene_id,
+    "bot": BotModel.self_id,
+    "adapter": BotModel.adapter,
+    "type": MessageRecord.type,
+}
+
+
+async def count_messages(**kwargs) -> int:
+    """统计消息记录数量
+
+    参数:
+      * ``**kwargs``: 筛选参数，具体查看 `filter_values` 中的定义
+
+    返回值:
+      * ``int``: 消息记录数量
+    """
+    statement, params, _ = await prepare_statement(
+        "count", lambda: select(func.count(MessageRecord.id)), filter_values(**kwargs)
+    )
+    async with get_session() as db_session:
+        count = await db_session.scalar(statement, params)
+    return count or 0
+
+
+async def group_count(
+    *,
+    by: Sequence[GroupBy] = (),
+    bucket: Optional[Bucket] = None,
+    **kwargs,
+) -> list[tuple]:
+    """分组统计消息记录数量
+
+    在数据库中进行分组统计，结果按分组字段排序
+
+    参数:
+      * ``by: Sequence[Literal["user", "scene", "bot", "adapter", "type"]]``: 分组字段，
+        分别为用户 id、事件场景 id、bot id、适配器类型和消息类型
+      * ``bucket: Optional[Literal["hour", "day"]]``: 按小时或天分组，为空表示不按时间分组；
+        时间为 UTC 时间
+      * ``**kwargs``: 筛选参数，具体查看 `filter_values` 中的定义
+
+    返回值:
+      * ``List[tuple]``: 统计结果，每一项依次为 `by` 中的各个字段、时间（仅在传入 `bucket` 时）和数量
+    """
+    columns: list[ColumnElement] = []
+    for key in by:
+        if key not in _GROUP_BY_COLUMNS:
+            raise ValueError(f"不支持的分组字段: {key!r}")
+        columns.append(_GROUP_BY_COLUMNS[key])
+    if bucket:
+        columns.append(time_bucket(MessageRecord.time, bucket))
+
+    def build() -> Select:
+        statement = select(*columns, func.count(MessageRecord.id))
+        if columns:
+            statement = statement.group_by(*columns).order_by(*columns)
+        return statement
+
+    statement, params, _ = await prepare_statement(
+        ("group_count", tuple(by), bucket), build, filter_values(**kwargs)
     )
     async with get_session() as db_session:
-        records = (await db_session.scalars(statement)).all()
-    return records
+        results = (await db_session.execute(statement, params)).all()
+    return [tuple(result) for result in results]
@@ -1,13 +1,67 @@
-from collections.abc import Iterable
+from collections.abc import AsyncIterator, Callable, Hashable, Iterable, Sequence
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Literal
+from typing import Any, Literal, TypeAlias, TypeVar
 
 from nonebot.adapters import Message
 from nonebot_plugin_uninfo import SceneType, Session, SupportAdapter, SupportScope
+from sqlalchemy import Row, Select
 from sqlalchemy.sql import ColumnElement
 
+from .cache import LRUCache
 from .model import MessageRecord
+from .sql import Bucket
 
+Order: TypeAlias = Literal["asc", "desc"]
+GroupBy: TypeAlias = Literal["user", "scene", "bot", "adapter", "type"]
+RowField: TypeAlias = Literal[
+    "id",
+    "session_persist_id",
+    "time",
+    "type",
+    "message_id",
+    "message",
+    "plain_text",
+    "self_id",
+    "adapter",
+    "scope",
+    "scene_type",
+    "scene_id",
+    "user_id",
+]
+_SelectT = TypeVar("_SelectT", bound=Select)
+
+STATEMENT_CACHE_SIZE: int
+SESSION_IDS_CACHE_SIZE: int
+SESSION_IDS_LIMIT: int
+SESSION_FILTERS: frozenset[str]
+
+def filter_values(
+    *,
+    session: Session | None = None,
+    filter_self_id: bool = True,
+    filter_adapter: bool = True,
+    filter_scope: bool = True,
+    filter_scene: bool = True,
+    filter_user: bool = True,
+    self_ids: Iterable[str] | None = None,
+    adapters: Iterable[str | SupportAdapter] | None = None,
+    scopes: Iterable[str | SupportScope] | None = None,
+    scene_types: Iterable[int | SceneType] | None = None,
+    scene_ids: Iterable[str] | None = None,
+    user_ids: Iterable[str] | None = None,
+    exclude_self_ids: Iterable[str] | None = None,
+    exclude_adapters: Iterable[str | SupportAdapter] | None = None,
+    exclude_scopes: Iterable[str | SupportScope] | None = None,
+    exclude_scene_types: Iterable[int | SceneType] | None = None,
+    exclude_scene_ids: Iterable[str] | None = None,
+    exclude_user_ids: Iterable[str] | None = None,
+    time_start: datetime | None = None,
+    time_stop: datetime | None = None,
+    types: Iterable[Literal["message", "message_sent"]] | None = None,
+    message_ids: Iterable[str] | None = None,
+) -> dict[str, Any]: ...
+def filter_clause(name: str, value: Any) -> ColumnElement[bool]: ...
 def filter_statement(
     *,
     session: Session | None = None,
@@ -31,9 +85,48 @@ def filter_statement(
     time_start: datetime | None = None,
     time_stop: datetime | None = None,
     types: Iterable[Literal["message", "message_sent"]] | None = None,
+    message_ids: Iterable[str] | None = None,
 ) -> list[ColumnElement[bool]]: ...
+def join_session_models(statement: _SelectT) -> _SelectT: ...
+
+statement_cache: LRUCache[Hashable, Select]
+
+def cached_statement(
+    shape: Hashable,
+    params: dict[str, Any],
+    build: Callable[[dict[str, Any]], _SelectT],
+) -> tuple[_SelectT, dict[str, Any]]: ...
+
+SessionIdsKey: TypeAlias = tuple[tuple[str, Hashable], ...]
+session_ids_cache: LRUCache[SessionIdsKey, tuple[dict[str, list[int]] | None, int]]
+
+async def resolve_session_filters(
+    filters: dict[str, Any],
+) -> dict[str, list[int]] | None: ...
+def encode_cursor(record: MessageRecord, order: Order, backward: bool) -> str: ...
+def decode_cursor(cursor: str) -> tuple[datetime, int, Order, bool]: ...
+async def prepare_statement(
+    key: Hashable,
+    build: Callable[[], _SelectT],
+    filters: dict[str, Any],
+    *,
+    order: Order | None = None,
+    limit: int | None = None,
+    cursor: str | None = None,
+) -> tuple[_SelectT, dict[str, Any], bool]: ...
+
+@dataclass
+class MessageRecordPage:
+    records: list[MessageRecord]
+    next_cursor: str | None
+    prev_cursor: str | None
+
 async def get_message_records(
     *,
+    order: Order = "asc",
+    limit: int | None = None,
+    cursor: str | None = None,
+    load_message: bool = True,
     session: Session | None = None,
     filter_self_id: bool = True,
     filter_adapter: bool = True,
@@ -55,9 +148,13 @@ async def get_message_records(
     time_start: datetime | None = None,
     time_stop: datetime | None = None,
     types: Iterable[Literal["message", "message_sent"]] | None = None,
+    message_ids: Iterable[str] | None = None,
 ) -> list[MessageRecord]: ...
 async def get_messages(
     *,
+    order: Order = "asc",
+    limit: int | None = None,
+    cursor: str | None = None,
     session: Session | None = None,
     filter_self_id: bool = True,
     filter_adapter: bool = True,
@@ -79,9 +176,14 @@ async def get_messages(
     time_start: datetime | None = None,
     time_stop: datetime | None = None,
     types: Iterable[Literal["message", "message_sent"]] | None = None,
+    message_ids: Iterable[str] | None = None,
 ) -> list[Message]: ...
+async def get_recent_messages(session: Session, n: int) -> list[Message]: ...
 async def get_messages_plain_text(
     *,
+    order: Order = "asc",
+    limit: int | None = None,
+    cursor: str | None = None,
     session: Session | None = None,
     filter_self_id: bool = True,
     filter_adapter: bool = True,
@@ -103,4 +205,234 @@ async def get_messages_plain_text(
     time_start: datetime | None = None,
     time_stop: datetime | None = None,
     types: Iterable[Literal["message", "message_sent"]] | None = None,
+    message_ids: Iterable[str] | None = None,
 ) -> list[str]: ...
+async def get_message_records_page(
+    *,
+    limit: int,
+    order: Order = "asc",
+    cursor: str | None = None,
+    load_message: bool = True,
+    session: Session | None = None,
+    filter_self_id: bool = True,
+    filter_adapter: bool = True,
+    filter_scope: bool = True,
+    filter_scene: bool = True,
+    filter_user: bool = True,
+    self_ids: Iterable[str] | None = None,
+    adapters: Iterable[str | SupportAdapter] | None = None,
+    scopes: Iterable[str | SupportScope] | None = None,
+    scene_types: Iterable[int | SceneType] | None = None,
+    scene_ids: Iterable[str] | None = None,
+    user_ids: Iterable[str] | None = None,
+    exclude_self_ids: Iterable[str] | None = None,
+    exclude_adapters: Iterable[str | SupportAdapter] | None = None,
+    exclude_scopes: Iterable[str | SupportScope] | None = None,
+    exclude_scene_types: Iterable[int | SceneType] | None = None,
+    exclude_scene_ids: Iterable[str] | None = None,
+    exclude_user_ids: Iterable[str] | None = None,
+    time_start: datetime | None = None,
+    time_stop: datetime | None = None,
+    types: Iterable[Literal["message", "message_sent"]] | None = None,
+    message_ids: Iterable[str] | None = None,
+) -> MessageRecordPage: ...
+async def get_records_by_message_ids(
+    session: Session, message_ids: Iterable[str]
+) -> dict[str, MessageRecord]: ...
+async def get_record_by_message_id(
+    session: Session, message_id: str
+) -> MessageRecord | None: ...
+async def get_context(
+    session: Session, message_id: str, before: int = 10, after: int = 10
+) -> list[MessageRecord]: ...
+async def get_message_rows(
+    *,
+    fields: Sequence[RowField],
+    order: Order = "asc",
+    limit: int | None = None,
+    cursor: str | None = None,
+    session: Session | None = None,
+    filter_self_id: bool = True,
+    filter_adapter: bool = True,
+    filter_scope: bool = True,
+    filter_scene: bool = True,
+    filter_user: bool = True,
+    self_ids: Iterable[str] | None = None,
+    adapters: Iterable[str | SupportAdapter] | None = None,
+    scopes: Iterable[str | SupportScope] | None = None,
+    scene_types: Iterable[int | SceneType] | None = None,
+    scene_ids: Iterable[str] | None = None,
+    user_ids: Iterable[str] | None = None,
+    exclude_self_ids: Iterable[str] | None = None,
+    exclude_adapters: Iterable[str | SupportAdapter] | None = None,
+    exclude_scopes: Iterable[str | SupportScope] | None = None,
+    exclude_scene_types: Iterable[int | SceneType] | None = None,
+    exclude_scene_ids: Iterable[str] | None = None,
+    exclude_user_ids: Iterable[str] | None = None,
+    time_start: datetime | None = None,
+    time_stop: datetime | None = None,
+    types: Iterable[Literal["message", "message_sent"]] | None = None,
+    message_ids: Iterable[str] | None = None,
+) -> list[Row]: ...
+def iter_message_records(
+    *,
+    order: Order = "asc",
+    chunk_size: int = 1000,
+    load_message: bool = True,
+    session: Session | None = None,
+    filter_self_id: bool = True,
+    filter_adapter: bool = True,
+    filter_scope: bool = True,
+    filter_scene: bool = True,
+    filter_user: bool = True,
+    self_ids: Iterable[str] | None = None,
+    adapters: Iterable[str | SupportAdapter] | None = None,
+    scopes: Iterable[str | SupportScope] | None = None,
+    scene_types: Iterable[int | SceneType] | None = None,
+    scene_ids: Iterable[str] | None = None,
+    user_ids: Iterable[str] | None = None,
+    exclude_self_ids: Iterable[str] | None = None,
+    exclude_adapters: Iterable[str | SupportAdapter] | None = None,
+    exclude_scopes: Iterable[str | SupportScope] | None = None,
+    exclude_scene_types: Iterable[int | SceneType] | None = None,
+    exclude_scene_ids: Iterable[str] | None = None,
+    exclude_user_ids: Iterable[str] | None = None,
+    time_start: datetime | None = None,
+    time_stop: datetime | None = None,
+    types: Iterable[Literal["message", "message_sent"]] | None = None,
+    message_ids: Iterable[str] | None = None,
+) -> AsyncIterator[MessageRecord]: ...
+def iter_messages(
+    *,
+    order: Order = "asc",
+    chunk_size: int = 1000,
+    session: Session | None = None,
+    filter_self_id: bool = True,
+    filter_adapter: bool = True,
+    filter_scope: bool = True,
+    filter_scene: bool = True,
+    filter_user: bool = True,
+    self_ids: Iterable[str] | None = None,
+    adapters: Iterable[str | SupportAdapter] | None = None,
+    scopes: Iterable[str | SupportScope] | None = None,
+    scene_types: Iterable[int | SceneType] | None = None,
+    scene_ids: Iterable[str] | None = None,
+    user_ids: Iterable[str] | None = None,
+    exclude_self_ids: Iterable[str] | None = None,
+    exclude_adapters: Iterable[str | SupportAdapter] | None = None,
+    exclude_scopes: Iterable[str | SupportScope] | None = None,
+    exclude_scene_types: Iterable[int | SceneType] | None = None,
+    exclude_scene_ids: Iterable[str] | None = None,
+    exclude_user_ids: Iterable[str] | None = None,
+    time_start: datetime | None = None,
+    time_stop: datetime | None = None,
+    types: Iterable[Literal["message", "message_sent"]] | None = None,
+    message_ids: Iterable[str] | None = None,
+) -> AsyncIterator[Message]: ...
+def iter_messages_plain_text(
+    *,
+    order: Order = "asc",
+    chunk_size: int = 1000,
+    session: Session | None = None,
+    filter_self_id: bool = True,
+    filter_adapter: bool = True,
+    filter_scope: bool = True,
+    filter_scene: bool = True,
+    filter_user: bool = True,
+    self_ids: Iterable[str] | None = None,
+    adapters: Iterable[str | SupportAdapter] | None = None,
+    scopes: Iterable[str | SupportScope] | None = None,
+    scene_types: Iterable[int | SceneType] | None = None,
+    scene_ids: Iterable[str] | None = None,
+    user_ids: Iterable[str] | None = None,
+    exclude_self_ids: Iterable[str] | None = None,
+    exclude_adapters: Iterable[str | SupportAdapter] | None = None,
+    exclude_scopes: Iterable[str | SupportScope] | None = None,
+    exclude_scene_types: Iterable[int | SceneType] | None = None,
+    exclude_scene_ids: Iterable[str] | None = None,
+    exclude_user_ids: Iterable[str] | None = None,
+    time_start: datetime | None = None,
+    time_stop: datetime | None = None,
+    types: Iterable[Literal["message", "message_sent"]] | None = None,
+    message_ids: Iterable[str] | None = None,
+) -> AsyncIterator[str]: ...
+def iter_message_rows(
+    *,
+    fields: Sequence[RowField],
+    order: Order = "asc",
+    chunk_size: int = 1000,
+    session: Session | None = None,
+    filter_self_id: bool = True,
+    filter_adapter: bool = True,
+    filter_scope: bool = True,
+    filter_scene: bool = True,
+    filter_user: bool = True,
+    self_ids: Iterable[str] | None = None,
+    adapters: Iterable[str | SupportAdapter] | None = None,
+    scopes: Iterable[str | SupportScope] | None = None,
+    scene_types: Iterable[int | SceneType] | None = None,
+    scene_ids: Iterable[str] | None = None,
+    user_ids: Iterable[str] | None = None,
+    exclude_self_ids: Iterable[str] | None = None,
+    exclude_adapters: Iterable[str | SupportAdapter] | None = None,
+    exclude_scopes: Iterable[str | SupportScope] | None = None,
+    exclude_scene_types: Iterable[int | SceneType] | None = None,
+    exclude_scene_ids: Iterable[str] | None = None,
+    exclude_user_ids: Iterable[str] | None = None,
+    time_start: datetime | None = None,
+    time_stop: datetime | None = None,
+    types: Iterable[Literal["message", "message_sent"]] | None = None,
+    message_ids: Iterable[str] | None = None,
+) -> AsyncIterator[Row]: ...
+async def count_messages(
+    *,
+    session: Session | None = None,
+    filter_self_id: bool = True,
+    filter_adapter: bool = True,
+    filter_scope: bool = True,
+    filter_scene: bool = True,
+    filter_user: bool = True,
+    self_ids: Iterable[str] | None = None,
+    adapters: Iterable[str | SupportAdapter] | None = None,
+    scopes: Iterable[str | SupportScope] | None = None,
+    scene_types: Iterable[int | SceneType] | None = None,
+    scene_ids: Iterable[str] | None = None,
+    user_ids: Iterable[str] | None = None,
+    exclude_self_ids: Iterable[str] | None = None,
+    exclude_adapters: Iterable[str | SupportAdapter] | None = None,
+    exclude_scopes: Iterable[str | SupportScope] | None = None,
+    exclude_scene_types: Iterable[int | SceneType] | None = None,
+    exclude_scene_ids: Iterable[str] | None = None,
+    exclude_user_ids: Iterable[str] | None = None,
+    time_start: datetime | None = None,
+    time_stop: datetime | None = None,
+    types: Iterable[Literal["message", "message_sent"]] | None = None,
+    message_ids: Iterable[str] | None = None,
+) -> int: ...
+async def group_count(
+    *,
+    by: Sequence[GroupBy] = (),
+    bucket: Bucket | None = None,
+    session: Session | None = None,
+    filter_self_id: bool = True,
+    filter_adapter: bool = True,
+    filter_scope: bool = True,
+    filter_scene: bool = True,
+    filter_user: bool = True,
+    self_ids: Iterable[str] | None = None,
+    adapters: Iterable[str | SupportAdapter] | None = None,
+    scopes: Iterable[str | SupportScope] | None = None,
+    scene_types: Iterable[int | SceneType] | None = None,
+    scene_ids: Iterable[str] | None = None,
+    user_ids: Iterable[str] | None = None,
+    exclude_self_ids: Iterable[str] | None = None,
+    exclude_adapters: Iterable[str | SupportAdapter] | None = None,
+    exclude_scopes: Iterable[str | SupportScope] | None = None,
+    exclude_scene_types: Iterable[int | SceneType] | None = None,
+    exclude_scene_ids: Iterable[str] | None = None,
+    exclude_user_ids: Iterable[str] | None = None,
+    time_start: datetime | None = None,
+    time_stop: datetime | None = None,
+    types: Iterable[Literal["message", "message_sent"]] | None = None,
+    message_ids: Iterable[str] | None = None,
+) -> list[tuple]: ...
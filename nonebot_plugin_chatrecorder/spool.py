@@ -0,0 +1,89 @@
+import json
+from collections.abc import Iterable
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from nonebot.log import logger
+from nonebot_plugin_uninfo import Session
+
+from .model import MessageRecord
+
+RecordEntry = tuple[Session, MessageRecord]
+
+
+def dump_entry(entry: RecordEntry) -> dict[str, Any]:
+    session, record = entry
+    session_data = json.loads(session.dump_json())
+    if isinstance(session.platform, set):
+        session_data["platform"] = sorted(session.platform)
+    return {
+        "session": session_data,
+        "time": record.time.isoformat(),
+        "type": record.type,
+        "message_id": record.message_id,
+        "message": record.message,
+        "plain_text": record.plain_text,
+    }
+
+
+def load_entry(data: dict[str, Any]) -> RecordEntry:
+    session_data = data["session"]
+    if isinstance(session_data.get("platform"), list):
+        session_data["platform"] = set(session_data["platform"])
+    session = Session.load(session_data)
+    record = MessageRecord(
+        time=datetime.fromisoformat(data["time"]),
+        type=data["type"],
+        message_id=data["message_id"],
+        message=data["message"],
+        plain_text=data["plain_text"],
+    )
+    return session, record
+
+
+class RecordSpool:
+    """消息记录本地暂存文件
+
+    以 JSON Lines 格式追加写入暂时无法写入数据库的消息记录；
+    重放时先将暂存文件改名为 `*.replay`，重放完成后再删除，
+    期间新加入的消息记录会写入新的暂存文件
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.replay_path = path.with_name(f"{path.name}.replay")
+
+    def __bool__(self) -> bool:
+        return self.path.exists() or self.replay_path.exists()
+
+    def append(self, entries: Iterable[RecordEntry]) -> None:
+        lines = [json.dumps(dump_entry(entry), ensure_ascii=False) for entry in entries]
+        if not lines:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def load(self) -> list[RecordEntry]:
+        """读取待重放的消息记录，重放完成后需调用 `commit`"""
+        if not self.replay_path.exists():
+            if not self.path.exists():
+                return []
+            self.path.replace(self.replay_path)
+
+        entries: list[RecordEntry] = []
+        with self.replay_path.open("r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entries.append(load_entry(json.loads(line)))
+                except Exception as e:
+                    # 写入过程中程序退出可能导致最后一行不完整
+                    logger.warning(f"chatrecorder: 跳过无法解析的暂存记录: {e!r}")
+        return entries
+
+    def commit(self) -> None:
+        """删除已重放的暂存文件"""
+        self.replay_path.unlink(missing_ok=True)
@@ -0,0 +1,151 @@
+import json
+from collections.abc import Iterable
+from datetime import datetime
+from typing import Any, Literal, Optional
+
+from sqlalchemy import (
+    ARRAY,
+    Boolean,
+    DateTime,
+    String,
+    all_,
+    any_,
+    bindparam,
+    func,
+    literal_column,
+    select,
+)
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import ColumnElement
+from sqlalchemy.sql.compiler import SQLCompiler
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.sql.visitors import InternalTraversal
+
+Bucket = Literal["hour", "day"]
+
+LARGE_IN_THRESHOLD = 500
+"""列表长度超过此值时，不再为每个值生成一个绑定参数，而是将整个列表作为一个参数传入
+
+旧版本 SQLite（3.32 之前）单条语句最多 999 个绑定参数，
+需为语句中的其他参数留出余量
+"""
+
+
+class large_in(ColumnElement[bool]):
+    """以单个绑定参数传入列表的 `IN` / `NOT IN`
+
+    数据库对单条语句中的绑定参数数量有限制，且参数过多时编译和执行都很慢；
+    SQLite 中使用 `json_each` 展开 JSON 数组，PostgreSQL 中使用 `= ANY(array)`，
+    其他数据库（如 MySQL）仍使用普通的 `IN`，列表较长时每个值仍是一个绑定参数
+    """
+
+    type = Boolean()
+    # 避免在不支持布尔类型的数据库中被编译为 `(...) = 1`，导致无法使用索引
+    _is_implicitly_boolean = True
+    # 列表内容不参与语句缓存，不缓存包含此表达式的语句
+    inherit_cache = False
+
+    def __init__(
+        self, column: ColumnElement[Any], values: list[Any], negate: bool = False
+    ) -> None:
+        self.column = column
+        self.values = values
+        self.negate = negate
+
+    @property
+    def _from_objects(self):  # type: ignore
+        return self.column._from_objects
+
+
+@compiles(large_in)
+def _compile_large_in(element: large_in, compiler: SQLCompiler, **kw) -> str:
+    column = element.column
+    values = element.values
+    expr = column.not_in(values) if element.negate else column.in_(values)
+    return compiler.process(expr, **kw)
+
+
+@compiles(large_in, "sqlite")
+def _compile_large_in_sqlite(element: large_in, compiler: SQLCompiler, **kw) -> str:
+    column = element.column
+    array = bindparam(None, json.dumps(element.values), type_=String())
+    subquery = select(literal_column("value")).select_from(func.json_each(array))
+    expr = column.not_in(subquery) if element.negate else column.in_(subquery)
+    return compiler.process(expr, **kw)
+
+
+@compiles(large_in, "postgresql")
+def _compile_large_in_postgresql(element: large_in, compiler: SQLCompiler, **kw) -> str:
+    column = element.column
+    array = bindparam(None, element.values, type_=ARRAY(column.type))
+    expr = column != all_(array) if element.negate else column == any_(array)
+    return compiler.process(expr, **kw)
+
+
+def in_values(
+    column: ColumnElement[Any],
+    values: Iterable[Any],
+    negate: bool = False,
+    key: Optional[str] = None,
+) -> ColumnElement[bool]:
+    """生成 `column IN values` 或 `column NOT IN values`
+
+    列表较短时使用可展开的绑定参数，即 `IN (__[POSTCOMPILE_x])`，
+    不同长度的列表可以共用同一条编译后的语句；列表较长时使用 `large_in`
+
+    `key` 为绑定参数的名称，指定后可在执行语句时以同名参数传入新的列表
+    """
+    values = list(dict.fromkeys(values))
+    if len(values) > LARGE_IN_THRESHOLD:
+        return large_in(column, values, negate)
+    param = bindparam(key, values, expanding=True) if key else values
+    return column.not_in(param) if negate else column.in_(param)
+
+
+class time_bucket(FunctionElement[datetime]):
+    """将时间截断到所在的小时或天
+
+    不同数据库的日期函数不同，编译时按方言生成对应的语句
+    """
+
+    type = DateTime()
+    inherit_cache = True
+    name = "time_bucket"
+    # 时间粒度需参与语句缓存的键，否则不同粒度会复用同一条编译后的语句
+    _traverse_internals = [
+        *FunctionElement._traverse_internals,
+        ("bucket", InternalTraversal.dp_string),
+    ]
+
+    def __init__(self, column: ColumnElement[datetime], bucket: Bucket) -> None:
+        if bucket not in ("hour", "day"):
+            raise ValueError(f"不支持的时间粒度: {bucket!r}")
+        self.bucket: Bucket = bucket
+        super().__init__(column)
+
+
+_BUCKET_FORMATS = {"hour": "%Y-%m-%d %H:00:00", "day": "%Y-%m-%d 00:00:00"}
+
+
+@compiles(time_bucket)
+def _compile_time_bucket(element: time_bucket, compiler: SQLCompiler, **kw) -> str:
+    return f"date_trunc('{element.bucket}', {compiler.process(element.clauses, **kw)})"
+
+
+@compiles(time_bucket, "sqlite")
+def _compile_time_bucket_sqlite(
+    element: time_bucket, compiler: SQLCompiler, **kw
+) -> str:
+    column = compiler.process(element.clauses, **kw)
+    fmt = compiler.render_literal_value(_BUCKET_FORMATS[element.bucket], String())
+    return f"strftime({fmt}, {column})"
+
+
+@compiles(time_bucket, "mysql")
+def _compile_time_bucket_mysql(
+    element: time_bucket, compiler: SQLCompiler, **kw
+) -> str:
+    column = compiler.process(element.clauses, **kw)
+    # 根据驱动的参数风格，格式字符串中的 % 可能需要转义
+    fmt = compiler.render_literal_value(_BUCKET_FORMATS[element.bucket], String())
+    return f"CAST(DATE_FORMAT({column}, {fmt}) AS DATETIME)"
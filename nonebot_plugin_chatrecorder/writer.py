@@ -0,0 +1,433 @@
+import asyncio
+import json
+from typing import Literal, Optional
+
+from nonebot import get_driver
+from nonebot.log import logger
+from nonebot_plugin_orm import get_session
+from nonebot_plugin_uninfo import Scene, Session
+from nonebot_plugin_uninfo.orm import BotModel, SceneModel, SessionModel, UserModel
+from sqlalchemy import exc, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .cache import (
+    SessionKey,
+    get_session_persist_id,
+    record_cache,
+    scene_key,
+    session_fingerprint,
+    session_generation,
+    session_key,
+    session_persist_id_cache,
+)
+from .config import plugin_config
+from .consts import SPOOL_FILE
+from .model import MessageRecord
+from .recent import RecentMessages, recent_messages
+from .spool import RecordEntry, RecordSpool
+from .sql import in_values
+from .utils import adapter_value, scene_type_value, scope_value
+
+OverflowPolicy = Literal["block", "drop_oldest", "spill"]
+
+DB_UNAVAILABLE_ERRORS = (
+    exc.OperationalError,
+    exc.InterfaceError,
+    exc.TimeoutError,
+    OSError,
+)
+""" 视为数据库不可用的异常，此时消息记录会写入本地暂存文件 """
+SPOOL_REPLAY_BATCH_SIZE = 1000
+
+
+async def _get_bot_persist_id(db_session: AsyncSession, session: Session) -> int:
+    statement = (
+        select(BotModel)
+        .where(BotModel.self_id == session.self_id)
+        .where(BotModel.adapter == adapter_value(session.adapter))
+    )
+    if bot_model := (await db_session.scalars(statement)).one_or_none():
+        bot_model.scope = scope_value(session.scope)
+    else:
+        bot_model = BotModel(
+            self_id=session.self_id,
+            adapter=adapter_value(session.adapter),
+            scope=scope_value(session.scope),
+        )
+        db_session.add(bot_model)
+    await db_session.flush()
+    return bot_model.id
+
+
+async def _get_scene_persist_id(
+    db_session: AsyncSession, bot_persist_id: int, scene: Scene
+) -> int:
+    parent_scene_persist_id = (
+        await _get_scene_persist_id(db_session, bot_persist_id, scene.parent)
+        if scene.parent
+        else None
+    )
+    scene_data = json.loads(scene.dump_json())
+    statement = (
+        select(SceneModel)
+        .where(SceneModel.bot_persist_id == bot_persist_id)
+        .where(SceneModel.scene_id == scene.id)
+        .where(SceneModel.scene_type == scene_type_value(scene.type))
+    )
+    if scene_model := (await db_session.scalars(statement)).one_or_none():
+        scene_model.parent_scene_persist_id = parent_scene_persist_id
+        scene_model.scene_data = scene_data
+    else:
+        scene_model = SceneModel(
+            bot_persist_id=bot_persist_id,
+            parent_scene_persist_id=parent_scene_persist_id,
+            scene_id=scene.id,
+            scene_type=scene_type_value(scene.type),
+            scene_data=scene_data,
+        )
+        db_session.add(scene_model)
+    await db_session.flush()
+    return scene_model.id
+
+
+async def _get_user_persist_id(
+    db_session: AsyncSession, bot_persist_id: int, session: Session
+) -> int:
+    user_data = json.loads(session.user.dump_json())
+    statement = (
+        select(UserModel)
+        .where(UserModel.bot_persist_id == bot_persist_id)
+        .where(UserModel.user_id == session.user.id)
+    )
+    if user_model := (await db_session.scalars(statement)).one_or_none():
+        user_model.user_data = user_data
+    else:
+        user_model = UserModel(
+            bot_persist_id=bot_persist_id,
+            user_id=session.user.id,
+            user_data=user_data,
+        )
+        db_session.add(user_model)
+    await db_session.flush()
+    return user_model.id
+
+
+async def resolve_session_persist_id(db_session: AsyncSession, session: Session) -> int:
+    """在给定的数据库会话中获取或创建会话持久化id，不提交事务"""
+    bot_persist_id = await _get_bot_persist_id(db_session, session)
+    scene_persist_id = await _get_scene_persist_id(
+        db_session, bot_persist_id, session.scene
+    )
+    user_persist_id = await _get_user_persist_id(db_session, bot_persist_id, session)
+    member_data = json.loads(session.member.dump_json()) if session.member else None
+    statement = (
+        select(SessionModel)
+        .where(SessionModel.bot_persist_id == bot_persist_id)
+        .where(SessionModel.scene_persist_id == scene_persist_id)
+        .where(SessionModel.user_persist_id == user_persist_id)
+    )
+    if session_model := (await db_session.scalars(statement)).one_or_none():
+        session_model.member_data = member_data
+    else:
+        session_model = SessionModel(
+            bot_persist_id=bot_persist_id,
+            scene_persist_id=scene_persist_id,
+            user_persist_id=user_persist_id,
+            member_data=member_data,
+        )
+        db_session.add(session_model)
+    await db_session.flush()
+    return session_model.id
+
+
+async def _remove_existing_records(
+    db_session: AsyncSession, records: list[MessageRecord]
+) -> list[MessageRecord]:
+    statement = select(
+        MessageRecord.session_persist_id, MessageRecord.message_id, MessageRecord.type
+    ).where(in_values(MessageRecord.message_id, [r.message_id for r in records]))
+    existing = set((await db_session.execute(statement)).tuples().all())
+    result: list[MessageRecord] = []
+    for record in records:
+        key = (record.session_persist_id, record.message_id, record.type)
+        if key not in existing:
+            existing.add(key)
+            result.append(record)
+    return result
+
+
+async def _insert_records(
+    db_session: AsyncSession, records: list[MessageRecord], deduplicate: bool
+) -> int:
+    if deduplicate:
+        records = await _remove_existing_records(db_session, records)
+    db_session.add_all(records)
+    await db_session.commit()
+    return len(records)
+
+
+async def write_records(entries: list[RecordEntry], deduplicate: bool = False) -> int:
+    """在同一个事务中获取会话持久化id并写入消息记录
+
+    参数:
+      * ``entries: list[RecordEntry]``: 会话及消息记录列表
+      * ``deduplicate: bool``: 是否跳过会话、消息id及消息类型均相同的已有消息记录
+
+    返回值:
+      * ``int``: 写入的消息记录数量
+    """
+    records = [record for _, record in entries]
+    resolved: dict[SessionKey, tuple[int, int]] = {}
+    fetched: list[int] = []
+    # 提交事务后消息记录的属性会过期，需提前获取
+    record_keys = [
+        (scene_key(session), record.message_id) for session, record in entries
+    ]
+    try:
+        async with get_session() as db_session:
+            for session, record in entries:
+                key = session_key(session)
+                fingerprint = session_fingerprint(session)
+                cached = resolved.get(key) or session_persist_id_cache.get(key)
+                if cached is None or cached[1] != fingerprint:
+                    # 会话信息有变化时重新获取，以更新数据库中的会话信息
+                    cached = (
+                        await resolve_session_persist_id(db_session, session),
+                        fingerprint,
+                    )
+                    fetched.append(cached[0])
+                resolved[key] = cached
+                record.session_persist_id = cached[0]
+            count = await _insert_records(db_session, records, deduplicate)
+    except exc.IntegrityError:
+        # 其他协程同时创建了相同的会话，回退为逐个获取会话持久化id
+        for session, record in entries:
+            record.session_persist_id = await get_session_persist_id(session)
+        async with get_session() as db_session:
+            count = await _insert_records(db_session, records, deduplicate)
+    else:
+        for key, cached in resolved.items():
+            session_persist_id_cache.set(key, cached)
+        # 事务提交后再更新版本号，使按会话筛选的缓存重新检查这些会话
+        session_generation.bump(fetched)
+    # 同一消息 id 可能有多条消息记录（如发出的消息与其回显），清除缓存以读取最新的一条
+    for key in record_keys:
+        record_cache.pop(key)
+    return count
+
+
+class RecordBuffer:
+    """消息记录写缓冲
+
+    收集各适配器产生的消息记录，在数量达到 `batch_size` 或等待超过 `flush_interval` 秒时，
+    在同一个事务中批量写入数据库
+
+    `nonblocking` 为 `True` 时，加入消息记录后立即返回，由后台任务写入数据库，
+    队列已满时的处理方式由 `overflow_policy` 决定：
+
+      * ``block``: 等待当前批次写入完成
+      * ``drop_oldest``: 丢弃队列中最早的消息记录
+      * ``spill``: 将消息记录写入本地暂存文件，在之后的写入完成后重放
+
+    传入 `spool` 时，数据库不可用导致写入失败的消息记录也会写入本地暂存文件，
+    在之后的写入完成后或调用 `replay_spool` 时按批次重放
+
+    传入 `recent` 时，加入的消息记录同时保存到内存中，用于获取事件场景中最近的消息
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        flush_interval: float,
+        max_queue_size: int,
+        nonblocking: bool = False,
+        overflow_policy: OverflowPolicy = "block",
+        spool: Optional[RecordSpool] = None,
+        recent: Optional[RecentMessages] = None,
+    ) -> None:
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_interval
+        self.max_queue_size = max(max_queue_size, self.batch_size)
+        self.nonblocking = nonblocking
+        self.overflow_policy: OverflowPolicy = overflow_policy
+        self.spool = spool
+        self.recent = recent
+        self.written = 0
+        """ 已写入的消息记录数 """
+        self.failed = 0
+        """ 写入失败的消息记录数 """
+        self.dropped = 0
+        """ 因队列已满而丢弃的消息记录数 """
+        self.spilled = 0
+        """ 写入本地暂存文件的消息记录数 """
+        self._pending: list[tuple[RecordEntry, Optional[asyncio.Future[None]]]] = []
+        self._flush_task: Optional[asyncio.Task[None]] = None
+        self._timer_task: Optional[asyncio.Task[None]] = None
+        self._replay_task: Optional[asyncio.Task[None]] = None
+        self._replaying = False
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def put(self, session: Session, record: MessageRecord) -> None:
+        """加入消息记录
+
+        非阻塞模式下加入队列后立即返回，否则等待其所在批次写入完成后返回
+        """
+        entry = (session, record)
+        if self.recent is not None:
+            self.recent.add(session, record)
+        if self.nonblocking and len(self._pending) >= self.max_queue_size:
+            if self.overflow_policy == "drop_oldest":
+                self._pending.pop(0)
+                self.dropped += 1
+            elif self.overflow_policy == "spill" and self.spool is not None:
+                self.spool.append([entry])
+                self.spilled += 1
+                return
+
+        while len(self._pending) >= self.max_queue_size:
+            await asyncio.shield(self._start_flush())
+
+        future = None
+        if not self.nonblocking:
+            future = asyncio.get_running_loop().create_future()
+        self._pending.append((entry, future))
+        if len(self._pending) >= self.batch_size:
+            self._start_flush()
+        elif self._timer_task is None:
+            self._timer_task = asyncio.create_task(self._flush_later())
+        if future:
+            await future
+
+    async def flush(self) -> None:
+        """立即写入所有缓冲中的消息记录，并等待正在进行的暂存消息记录重放完成"""
+        if self._pending or (self._flush_task and not self._flush_task.done()):
+            await asyncio.shield(self._start_flush())
+        if self._replay_task and not self._replay_task.done():
+            await asyncio.shield(self._replay_task)
+
+    def _start_flush(self) -> "asyncio.Task[None]":
+        if self._timer_task is not None:
+            self._timer_task.cancel()
+            self._timer_task = None
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_all())
+        return self._flush_task
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        self._timer_task = None
+        self._start_flush()
+
+    async def _flush_all(self) -> None:
+        # 写入期间新加入的记录会在下一轮一并写入
+        succeeded = False
+        while self._pending:
+            batch = self._pending[: self.batch_size]
+            del self._pending[: self.batch_size]
+            entries = [entry for entry, _ in batch]
+            try:
+                await write_records(entries)
+            except Exception as e:
+                succeeded = False
+                if self._spill(entries, e):
+                    logger.warning(
+                        f"chatrecorder: 数据库不可用，{len(batch)} 条消息记录已写入暂存文件: {e!r}"
+                    )
+                    for _, future in batch:
+                        if future and not future.done():
+                            future.set_result(None)
+                    continue
+
+                self.failed += len(batch)
+                if self.nonblocking:
+                    logger.opt(exception=e).error("chatrecorder: 消息记录写入失败")
+                for _, future in batch:
+                    if future and not future.done():
+                        future.set_exception(e)
+            else:
+                succeeded = True
+                self.written += len(batch)
+                for _, future in batch:
+                    if future and not future.done():
+                        future.set_result(None)
+
+        if succeeded:
+            # 在单独的任务中重放，避免重放期间加入的消息记录等待重放完成才写入
+            self._start_replay()
+
+    def _start_replay(self) -> None:
+        if self.spool is None or self._replaying or not self.spool:
+            return
+        if self._replay_task is None or self._replay_task.done():
+            self._replay_task = asyncio.create_task(self.replay_spool())
+
+    def _spill(self, entries: list[RecordEntry], error: Exception) -> bool:
+        """数据库不可用时将消息记录写入本地暂存文件"""
+        if self.spool is None or not isinstance(error, DB_UNAVAILABLE_ERRORS):
+            return False
+        try:
+            self.spool.append(entries)
+        except OSError as e:
+            logger.opt(exception=e).error("chatrecorder: 消息记录写入暂存文件失败")
+            return False
+        self.spilled += len(entries)
+        return True
+
+    async def replay_spool(self) -> None:
+        """按批次重放本地暂存文件中的消息记录，跳过数据库中已有的消息记录"""
+        if self.spool is None or self._replaying or not self.spool:
+            return
+
+        self._replaying = True
+        try:
+            entries = self.spool.load()
+            for i in range(0, len(entries), SPOOL_REPLAY_BATCH_SIZE):
+                batch = entries[i : i + SPOOL_REPLAY_BATCH_SIZE]
+                self.written += await write_records(batch, deduplicate=True)
+            self.spool.commit()
+            if entries:
+                logger.info(f"chatrecorder: 已重放 {len(entries)} 条暂存消息记录")
+        except DB_UNAVAILABLE_ERRORS as e:
+            logger.warning(f"chatrecorder: 数据库不可用，暂存消息记录重放失败: {e!r}")
+        except Exception as e:
+            logger.opt(exception=e).error("chatrecorder: 暂存消息记录重放失败")
+        finally:
+            self._replaying = False
+
+
+record_buffer = RecordBuffer(
+    batch_size=plugin_config.chatrecorder_record_batch_size,
+    flush_interval=plugin_config.chatrecorder_record_flush_interval,
+    max_queue_size=plugin_config.chatrecorder_record_max_queue_size,
+    nonblocking=plugin_config.chatrecorder_record_nonblocking,
+    overflow_policy=plugin_config.chatrecorder_record_overflow_policy,
+    spool=RecordSpool(SPOOL_FILE),
+    recent=recent_messages,
+)
+
+
+_replay_task: Optional[asyncio.Task[None]] = None
+
+
+async def _replay_periodically() -> None:
+    while True:
+        await asyncio.sleep(plugin_config.chatrecorder_spool_replay_interval)
+        await record_buffer.replay_spool()
+
+
+driver = get_driver()
+
+
+@driver.on_startup
+async def _():
+    global _replay_task
+    _replay_task = asyncio.create_task(_replay_periodically())
+
+
+@driver.on_shutdown
+async def _():
+    if _replay_task:
+        _replay_task.cancel()
+    await record_buffer.flush()
@@ -30,7 +30,14 @@ async def app():
     from nonebot_plugin_orm import get_session, init_orm
     from nonebot_plugin_uninfo.orm import BotModel, SceneModel, SessionModel, UserModel
 
+    from nonebot_plugin_chatrecorder.cache import (
+        message_cache,
+        record_cache,
+        session_persist_id_cache,
+    )
     from nonebot_plugin_chatrecorder.model import MessageRecord
+    from nonebot_plugin_chatrecorder.recent import recent_messages
+    from nonebot_plugin_chatrecorder.record import session_ids_cache, statement_cache
 
     await init_orm()
 
@@ -44,6 +51,13 @@ async def app():
         await db_session.execute(delete(BotModel))
         await db_session.commit()
 
+    session_persist_id_cache.clear()
+    message_cache.clear()
+    record_cache.clear()
+    recent_messages.clear()
+    session_ids_cache.clear()
+    statement_cache.clear()
+
 
 @pytest.fixture(scope="session", autouse=True)
 def after_nonebot_init(after_nonebot_init: None):
@@ -0,0 +1,86 @@
+from nonebug.app import App
+
+from .utils import new_record, new_session
+
+
+async def test_lru_cache(app: App):
+    """测试 LRU 缓存"""
+    from nonebot_plugin_chatrecorder.cache import LRUCache
+
+    cache: LRUCache[str, int] = LRUCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+    assert cache.hits == 2
+    assert cache.misses == 1
+
+    cache = LRUCache(0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+async def test_session_generation(app: App):
+    """测试会话的版本号"""
+    from nonebot_plugin_chatrecorder.cache import SessionGeneration
+
+    generation = SessionGeneration(3)
+    assert generation.since(0) == []
+    generation.bump([1, 2])
+    assert generation.value == 2
+    assert generation.since(0) == [1, 2]
+    assert generation.since(1) == [2]
+    assert generation.since(2) == []
+
+    # 记录的数量不足时无法得知之后获取的会话
+    generation.bump([3, 4])
+    assert generation.since(1) == [2, 3, 4]
+    assert generation.since(0) is None
+
+
+async def test_session_persist_id_cache(app: App):
+    """测试会话持久化id缓存"""
+    from nonebot_plugin_uninfo.orm import get_session_model
+
+    from nonebot_plugin_chatrecorder.cache import (
+        get_session_persist_id,
+        session_key,
+        session_persist_id_cache,
+    )
+    from nonebot_plugin_chatrecorder.writer import write_records
+
+    session = new_session()
+    hits = session_persist_id_cache.hits
+    session_persist_id = await get_session_persist_id(session)
+    assert session_key(session) in session_persist_id_cache
+    assert session_persist_id_cache.hits == hits
+
+    assert await get_session_persist_id(session) == session_persist_id
+    assert session_persist_id_cache.hits == hits + 1
+
+    session_model = await get_session_model(session_persist_id)
+    assert session_model.id == session_persist_id
+
+    # 会话信息有变化时更新数据库
+    session.user.name = "user"
+    assert await get_session_persist_id(session) == session_persist_id
+    session_model = await get_session_model(session_persist_id)
+    assert (await session_model.to_session()).user.name == "user"
+
+    # 批量写入消息记录时同样更新
+    session.scene.name = "group"
+    await write_records(
+        [
+            (
+                session,
+                new_record("1"),
+            )
+        ]
+    )
+    session_model = await get_session_model(session_persist_id)
+    assert (await session_model.to_session()).scene.name == "group"
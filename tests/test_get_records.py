@@ -10,9 +10,14 @@ from nonebot.adapters.onebot.v12 import Bot as V12Bot
 from nonebot.adapters.onebot.v12 import Message as V12Msg
 from nonebug.app import App
 
+from .utils import new_record, new_session
+
 
 async def test_get_message_records(app: App):
     """测试获取消息记录"""
+    from unittest.mock import patch
+
+    import pytest
     from nonebot_plugin_orm import get_session
     from nonebot_plugin_uninfo import (
         Scene,
@@ -23,13 +28,23 @@ async def test_get_message_records(app: App):
         User,
     )
     from nonebot_plugin_uninfo.orm import get_session_persist_id
+    from sqlalchemy.exc import InvalidRequestError
+    from sqlalchemy.orm.exc import DetachedInstanceError
 
+    from nonebot_plugin_chatrecorder.config import plugin_config
     from nonebot_plugin_chatrecorder.message import serialize_message
     from nonebot_plugin_chatrecorder.model import MessageRecord
     from nonebot_plugin_chatrecorder.record import (
+        count_messages,
         get_message_records,
+        get_message_rows,
         get_messages,
         get_messages_plain_text,
+        group_count,
+        iter_message_records,
+        iter_message_rows,
+        iter_messages,
+        iter_messages_plain_text,
     )
 
     async with app.test_api() as ctx:
@@ -212,6 +227,16 @@ async def test_get_message_records(app: App):
     msgs = await get_message_records(exclude_user_ids=["1000"])
     assert len(msgs) == 3
 
+    # 列表较长时以单个参数传入
+    many_user_ids = [str(i) for i in range(2000, 4000)]
+    msgs = await get_message_records(user_ids=["1000", *many_user_ids])
+    assert len(msgs) == 2
+    msgs = await get_message_records(exclude_user_ids=["1000", *many_user_ids])
+    assert len(msgs) == 3
+    many_scene_types = [SceneType.PRIVATE, *range(1000, 3000)]
+    msgs = await get_message_records(scene_types=many_scene_types)
+    assert len(msgs) == 2
+
     msgs = await get_message_records(scene_ids=["10000"])
     assert len(msgs) == 1
     msgs = await get_message_records(exclude_scene_ids=["10000"])
@@ -278,3 +303,579 @@ async def test_get_message_records(app: App):
         session=sessions[1], filter_scene=True, filter_user=False
     )
     assert len(msgs) == 1
+
+    records = [
+        record.message_id
+        async for record in iter_message_records(order="desc", chunk_size=2)
+    ]
+    assert records == [
+        record.message_id for record in await get_message_records(order="desc")
+    ]
+    msgs = [msg async for msg in iter_messages(adapters=[SupportAdapter.onebot12])]
+    assert msgs == await get_messages(adapters=[SupportAdapter.onebot12])
+    msgs = [msg async for msg in iter_messages_plain_text(chunk_size=2)]
+    assert msgs == [f"test message {i}" for i in range(1, 6)]
+
+    assert await count_messages() == 5
+    assert await count_messages(adapters=[SupportAdapter.onebot11]) == 2
+    assert (
+        await count_messages(session=sessions[1], filter_scene=True, filter_user=False)
+        == 1
+    )
+    assert await group_count() == [(5,)]
+    assert await group_count(by=["adapter", "type"]) == [
+        ("OneBot V11", "message", 1),
+        ("OneBot V11", "message_sent", 1),
+        ("OneBot V12", "message", 3),
+    ]
+    assert await group_count(by=["user"], types=["message"]) == [
+        ("1000", 1),
+        ("1001", 1),
+        ("1002", 1),
+        ("1003", 1),
+    ]
+    hour = datetime.fromtimestamp(1000000, timezone.utc).replace(
+        minute=0, second=0, tzinfo=None
+    )
+    assert await group_count(by=["bot"], bucket="hour", self_ids=["100"]) == [
+        ("100", hour, 2)
+    ]
+    assert await group_count(bucket="day") == [(hour.replace(hour=0), 5)]
+
+    rows = await get_message_rows(
+        fields=["message_id", "self_id", "scene_id", "user_id", "plain_text"],
+        types=["message"],
+        order="desc",
+        limit=2,
+    )
+    assert rows == [
+        ("3", "103", "10002", "1003", "test message 5"),
+        ("3", "102", "10001", "1002", "test message 4"),
+    ]
+    assert rows[0].scene_id == "10002"
+    assert rows[0].plain_text == "test message 5"
+    rows = await get_message_rows(fields=["time", "plain_text"], user_ids=["1000"])
+    assert [row.plain_text for row in rows] == ["test message 1", "test message 2"]
+    assert rows[0].time == datetime.fromtimestamp(1000000, timezone.utc).replace(
+        tzinfo=None
+    )
+    rows = [
+        row
+        async for row in iter_message_rows(
+            fields=["adapter", "plain_text"], chunk_size=2
+        )
+    ]
+    assert rows == list(await get_message_rows(fields=["adapter", "plain_text"]))
+    with pytest.raises(ValueError):
+        await get_message_rows(fields=["unknown"])  # type: ignore
+
+    # 只查询会话相关的字段
+    rows = await get_message_rows(fields=["self_id", "plain_text"])
+    assert list(await get_message_rows(fields=["self_id"])) == [
+        (row.self_id,) for row in rows
+    ]
+    rows = await get_message_rows(fields=["scene_id", "user_id"], order="desc", limit=1)
+    assert rows == [("10002", "1003")]
+    with patch.object(plugin_config, "chatrecorder_query_resolve_sessions", False):
+        rows = await get_message_rows(fields=["self_id"], self_ids=["100"])
+    assert rows == [("100",)] * 2
+
+    records = await get_message_records(load_message=False, order="desc", limit=1)
+    assert records[0].plain_text == "test message 5"
+    assert "message" not in records[0].__dict__
+    with pytest.raises(DetachedInstanceError):
+        records[0].message
+    records = []
+    async for record in iter_message_records(load_message=False):
+        with pytest.raises(InvalidRequestError):
+            record.message
+        records.append(record)
+    assert len(records) == 5
+
+
+async def test_get_message_records_page(app: App):
+    """测试分页获取消息记录"""
+    import pytest
+    from nonebot_plugin_orm import get_session
+    from nonebot_plugin_uninfo.orm import get_session_persist_id
+
+    from nonebot_plugin_chatrecorder.model import MessageRecord
+    from nonebot_plugin_chatrecorder.record import (
+        get_message_records,
+        get_message_records_page,
+        get_messages_plain_text,
+    )
+
+    session = new_session()
+    session_persist_id = await get_session_persist_id(session)
+
+    # 插入顺序与时间顺序不同，且部分消息的时间相同
+    times = [3, 1, 2, 2, 5, 4, 2]
+    async with get_session() as db_session:
+        for i, t in enumerate(times):
+            db_session.add(
+                MessageRecord(
+                    session_persist_id=session_persist_id,
+                    time=datetime.fromtimestamp(1000000 + t, timezone.utc).replace(
+                        tzinfo=None
+                    ),
+                    type="message",
+                    message_id=str(i),
+                    message=[{"type": "text", "data": {"text": str(i)}}],
+                    plain_text=str(i),
+                )
+            )
+        await db_session.commit()
+
+    expected = ["1", "2", "3", "6", "0", "5", "4"]
+
+    records = await get_message_records()
+    assert [record.message_id for record in records] == expected
+    records = await get_message_records(order="desc", limit=3)
+    assert [record.message_id for record in records] == expected[::-1][:3]
+    assert await get_messages_plain_text(limit=2) == expected[:2]
+
+    async def collect(order) -> list[str]:
+        message_ids: list[str] = []
+        cursors: list[str] = []
+        cursor = None
+        while True:
+            page = await get_message_records_page(limit=3, order=order, cursor=cursor)
+            message_ids.extend(record.message_id for record in page.records)
+            assert (page.prev_cursor is None) == (cursor is None)
+            if not (cursor := page.next_cursor):
+                break
+            cursors.append(cursor)
+
+        # 从最后一页向前翻页
+        page = await get_message_records_page(limit=3, order=order, cursor=cursors[-1])
+        backward: list[str] = [record.message_id for record in page.records]
+        cursor = page.prev_cursor
+        while cursor:
+            page = await get_message_records_page(limit=3, order=order, cursor=cursor)
+            assert page.next_cursor
+            backward = [record.message_id for record in page.records] + backward
+            cursor = page.prev_cursor
+        assert backward == message_ids
+        return message_ids
+
+    assert await collect("asc") == expected
+    assert await collect("desc") == expected[::-1]
+
+    page = await get_message_records_page(limit=3, order="asc")
+    assert page.next_cursor
+    # 游标的排序方向需与查询一致
+    with pytest.raises(ValueError):
+        await get_message_records(order="desc", cursor=page.next_cursor)
+    with pytest.raises(ValueError):
+        await get_message_records(cursor="invalid")
+
+
+async def test_join_session_models(app: App):
+    """测试只连接查询用到的表"""
+    from nonebot_plugin_uninfo.orm import BotModel
+    from sqlalchemy import select
+
+    from nonebot_plugin_chatrecorder.model import MessageRecord
+    from nonebot_plugin_chatrecorder.record import filter_statement, join_session_models
+
+    def joined_tables(statement) -> set[str]:
+        sql = str(join_session_models(statement))
+        return {
+            name
+            for name in ("sessionmodel", "botmodel", "scenemodel", "usermodel")
+            if f"nonebot_plugin_uninfo_{name} ON" in sql
+        }
+
+    whereclause = filter_statement(time_start=datetime(2024, 1, 1))
+    assert joined_tables(select(MessageRecord).where(*whereclause)) == set()
+
+    whereclause = filter_statement(user_ids=["1"], types=["message"])
+    assert joined_tables(select(MessageRecord.plain_text).where(*whereclause)) == {
+        "sessionmodel",
+        "usermodel",
+    }
+
+    whereclause = filter_statement(scene_ids=["1"])
+    statement = select(MessageRecord.message, BotModel.adapter).where(*whereclause)
+    assert joined_tables(statement) == {"sessionmodel", "botmodel", "scenemodel"}
+
+
+async def test_resolve_session_filters(app: App):
+    """测试先查询事件场景或会话的持久化 id 再查询消息记录"""
+    from unittest.mock import patch
+
+    from sqlalchemy import select
+
+    from nonebot_plugin_chatrecorder.config import plugin_config
+    from nonebot_plugin_chatrecorder.model import MessageRecord
+    from nonebot_plugin_chatrecorder.record import (
+        count_messages,
+        filter_values,
+        get_message_rows,
+        prepare_statement,
+        resolve_session_filters,
+        session_ids_cache,
+    )
+    from nonebot_plugin_chatrecorder.writer import write_records
+
+    sessions = [new_session("10000", "10"), new_session("10001", "10")]
+    await write_records(
+        [(session, new_record(str(i))) for i, session in enumerate(sessions)]
+    )
+
+    # 筛选用户时按会话持久化 id 筛选
+    filters = filter_values(user_ids=["10"])
+    resolved = await resolve_session_filters(filters)
+    assert resolved is not None
+    session_ids = resolved["session_ids"]
+    assert len(session_ids) == 2
+    assert len(session_ids_cache) == 1
+
+    # 没有获取新的会话时直接返回缓存，不查询数据库
+    with patch("nonebot_plugin_chatrecorder.record.get_session", None):
+        assert await resolve_session_filters(filters) == resolved
+
+    # 写入新会话的消息记录后只检查新获取的会话
+    await write_records(
+        [
+            (new_session("10002", "10"), new_record("2")),
+            (new_session("10002", "20"), new_record("3")),
+        ]
+    )
+    resolved = await resolve_session_filters(filters)
+    assert resolved is not None
+    assert resolved["session_ids"][:2] == session_ids
+    assert len(resolved["session_ids"]) == 3
+    session_ids = resolved["session_ids"]
+
+    # 筛选会话信息时不连接消息记录表与会话相关的表
+    statement, params, _ = await prepare_statement(
+        "records", lambda: select(MessageRecord), filters
+    )
+    assert "JOIN" not in str(statement)
+    assert params == {"session_ids": session_ids}
+    assert await count_messages(user_ids=["10"], scene_ids=["10000"]) == 1
+
+    # 不筛选用户时按事件场景持久化 id 筛选，事件场景中的会话在子查询中展开
+    filters = filter_values(scene_ids=["10002"])
+    resolved = await resolve_session_filters(filters)
+    assert resolved is not None
+    assert len(resolved["bot_persist_ids"]) == 1
+    assert len(resolved["scene_persist_ids"]) == 1
+    statement, params, _ = await prepare_statement(
+        "records", lambda: select(MessageRecord), filters
+    )
+    assert "JOIN" not in str(statement)
+    assert params == resolved
+    assert await count_messages(scene_ids=["10002"]) == 2
+
+    # 事件场景中新增成员不影响筛选条件
+    await write_records([(new_session("10002", "30"), new_record("4"))])
+    assert await resolve_session_filters(filters) == resolved
+    assert await count_messages(scene_ids=["10002"]) == 3
+    rows = await get_message_rows(
+        fields=["scene_id", "user_id", "plain_text"], scene_ids=["10002"]
+    )
+    assert sorted(row[1] for row in rows) == ["10", "20", "30"]
+
+    with patch.object(plugin_config, "chatrecorder_query_resolve_sessions", False):
+        statement, params, _ = await prepare_statement(
+            "records", lambda: select(MessageRecord), filter_values(user_ids=["10"])
+        )
+        assert "JOIN" in str(statement)
+        assert params == {"user_ids": ["10"]}
+        assert await count_messages(user_ids=["10"], scene_ids=["10000"]) == 1
+
+    # 符合条件的会话过多时回退为连接会话相关的表，不缓存会话持久化 id 列表
+    filters = filter_values(user_ids=["10"])
+    with patch("nonebot_plugin_chatrecorder.record.SESSION_IDS_LIMIT", 2):
+        session_ids_cache.clear()
+        assert await resolve_session_filters(filters) is None
+        assert len(session_ids_cache) == 1
+        await write_records([(new_session("10003", "10"), new_record("5"))])
+        assert await resolve_session_filters(filters) is None
+        statement, params, _ = await prepare_statement(
+            "records", lambda: select(MessageRecord), filters
+        )
+        assert "JOIN" in str(statement)
+        assert params == {"user_ids": ["10"]}
+        assert await count_messages(user_ids=["10"]) == 4
+        resolved = await resolve_session_filters(filter_values(user_ids=["30"]))
+        assert resolved is not None
+        assert len(resolved["session_ids"]) == 1
+
+
+async def test_statement_cache(app: App):
+    """测试查询语句缓存"""
+    from datetime import timedelta
+
+    from sqlalchemy import select
+    from sqlalchemy.dialects import sqlite
+
+    from nonebot_plugin_chatrecorder.model import MessageRecord
+    from nonebot_plugin_chatrecorder.record import (
+        filter_values,
+        prepare_statement,
+        statement_cache,
+    )
+    from nonebot_plugin_chatrecorder.sql import LARGE_IN_THRESHOLD
+
+    async def prepare(**kwargs):
+        return await prepare_statement(
+            "records",
+            lambda: select(MessageRecord),
+            filter_values(**kwargs),
+            order="desc",
+            limit=10,
+        )
+
+    # 筛选条件的值不同但结构相同时，复用同一条查询语句
+    time = datetime(2024, 1, 1)
+    statement1, params1, _ = await prepare(types=["message"], time_start=time)
+    statement2, params2, _ = await prepare(
+        types=["message", "message_sent"], time_start=time + timedelta(days=1)
+    )
+    assert statement1 is statement2
+    assert params1 == {"types": ["message"], "time_start": time, "limit": 10}
+    assert params2["types"] == ["message", "message_sent"]
+    assert len(statement_cache) == 1
+
+    # 结构不同时生成新的查询语句
+    statement3, _, _ = await prepare(types=["message"])
+    assert statement3 is not statement1
+    assert len(statement_cache) == 2
+
+    # 含有较长列表的查询语句不会被缓存
+    types = [str(i) for i in range(LARGE_IN_THRESHOLD + 1)]
+    statement4, params4, _ = await prepare(types=types)
+    assert statement4 is not statement3
+    assert params4 == {"limit": 10}
+    assert len(statement_cache) == 2
+
+    # 较长列表在 SQLite 中只占用一个绑定参数
+    compiled = statement4.compile(dialect=sqlite.dialect())
+    assert compiled.positiontup == ["param_1", "limit", "param_2"]
+
+
+async def test_message_cache(app: App):
+    """测试消息缓存"""
+    from unittest.mock import patch
+
+    from nonebot_plugin_chatrecorder import record
+    from nonebot_plugin_chatrecorder.cache import message_cache
+    from nonebot_plugin_chatrecorder.model import MessageRecord
+    from nonebot_plugin_chatrecorder.record import get_messages, iter_messages
+    from nonebot_plugin_chatrecorder.writer import write_records
+
+    session = new_session()
+    await write_records(
+        [
+            (
+                session,
+                new_record(str(i), f"test {i}"),
+            )
+            for i in range(3)
+        ]
+    )
+    expected = [V11Msg(f"test {i}") for i in range(3)]
+
+    # 默认不缓存
+    assert await get_messages() == expected
+    assert len(message_cache) == 0
+
+    with patch.object(message_cache, "maxsize", 2):
+        hits, misses = message_cache.hits, message_cache.misses
+        assert await get_messages() == expected
+        assert len(message_cache) == 2
+        assert message_cache.misses - misses == 3
+
+        msgs = await get_messages(limit=2, order="desc")
+        assert msgs == expected[:0:-1]
+        assert message_cache.hits - hits == 2
+
+        # 修改返回的消息不会影响缓存
+        msgs[0][0].data["text"] = "changed"
+        msgs[0].append("changed")
+        assert [msg async for msg in iter_messages()] == expected
+
+        # 逐条获取时未命中缓存的消息直接从查询结果中读取，不另外打开数据库会话
+        message_cache.clear()
+        with patch.object(record, "get_session", wraps=record.get_session) as mocked:
+            assert [msg async for msg in iter_messages()] == expected
+        assert mocked.call_count == 1
+        assert len(message_cache) == 2
+
+        # 修改嵌套的消息段数据也不会影响缓存
+        await write_records(
+            [
+                (
+                    session,
+                    MessageRecord(
+                        time=datetime(2024, 1, 2),
+                        type="message",
+                        message_id="3",
+                        message=[
+                            {
+                                "type": "node",
+                                "data": {
+                                    "user_id": "10",
+                                    "nickname": "test",
+                                    "content": [
+                                        {"type": "text", "data": {"text": "nested"}}
+                                    ],
+                                },
+                            }
+                        ],
+                        plain_text="",
+                    ),
+                )
+            ]
+        )
+        msgs = await get_messages(message_ids=["3"])
+        msgs[0][0].data["content"][0]["data"]["text"] = "changed"
+        hits = message_cache.hits
+        msgs = await get_messages(message_ids=["3"])
+        assert message_cache.hits - hits == 1
+        assert msgs[0][0].data["content"][0]["data"]["text"] == "nested"
+
+
+async def test_get_recent_messages(app: App):
+    """测试获取最近的消息"""
+
+    from nonebot_plugin_chatrecorder.recent import recent_messages
+    from nonebot_plugin_chatrecorder.record import get_recent_messages
+    from nonebot_plugin_chatrecorder.writer import record_buffer, write_records
+
+    # 之前的消息只在数据库中
+    await write_records(
+        [
+            (
+                new_session(),
+                new_record(str(i), f"test {i}", datetime(2024, 1, 1, 0, 0, i)),
+            )
+            for i in range(3)
+        ]
+    )
+    for i in range(3, 5):
+        await record_buffer.put(
+            new_session(user_id=str(i)),
+            new_record(str(i), f"test {i}", datetime(2024, 1, 1, 0, 0, i)),
+        )
+    assert len(recent_messages) == 2
+
+    hits, misses = recent_messages.hits, recent_messages.misses
+    msgs = await get_recent_messages(new_session(), 2)
+    assert msgs == [V11Msg("test 3"), V11Msg("test 4")]
+    assert recent_messages.hits - hits == 1
+
+    # 内存中的消息不足时从数据库中查询
+    msgs = await get_recent_messages(new_session(), 4)
+    assert msgs == [V11Msg(f"test {i}") for i in range(1, 5)]
+    assert recent_messages.misses - misses == 1
+    assert await get_recent_messages(new_session(), 0) == []
+
+    # 修改返回的消息不会影响内存中的消息
+    msgs = await get_recent_messages(new_session(), 1)
+    msgs[0][0].data["text"] = "changed"
+    assert await get_recent_messages(new_session(), 1) == [V11Msg("test 4")]
+
+
+async def test_get_records_by_message_ids(app: App):
+    """测试按消息 id 获取消息记录"""
+
+    from nonebot_plugin_chatrecorder.cache import record_cache
+    from nonebot_plugin_chatrecorder.record import (
+        get_message_records,
+        get_record_by_message_id,
+        get_records_by_message_ids,
+    )
+    from nonebot_plugin_chatrecorder.writer import write_records
+
+    await write_records(
+        [
+            (new_session("10000"), new_record("1", "a")),
+            (new_session("10000", user_id="20"), new_record("2", "b")),
+            (new_session("10001"), new_record("1", "c")),
+            (new_session("10000"), new_record("3", "d")),
+        ]
+    )
+
+    records = await get_message_records(message_ids=["1", "3"])
+    assert [record.plain_text for record in records] == ["a", "c", "d"]
+
+    # 按事件场景查找，不区分用户
+    session = new_session("10000", user_id="30")
+    record = await get_record_by_message_id(session, "2")
+    assert record and record.plain_text == "b"
+    assert await get_record_by_message_id(session, "4") is None
+    record = await get_record_by_message_id(new_session("10001"), "1")
+    assert record and record.plain_text == "c"
+
+    records = await get_records_by_message_ids(session, ["3", "4", "1", "3"])
+    assert list(records) == ["3", "1"]
+    assert [record.plain_text for record in records.values()] == ["d", "a"]
+
+    # 命中缓存时不查询数据库，未找到的消息 id 不会被缓存
+    assert len(record_cache) == 4
+    hits = record_cache.hits
+    record = await get_record_by_message_id(session, "1")
+    assert record and record.id == records["1"].id
+    assert record_cache.hits - hits == 1
+    await write_records([(new_session("10000"), new_record("4", "e"))])
+    record = await get_record_by_message_id(session, "4")
+    assert record and record.plain_text == "e"
+
+    # 返回的是缓存中消息记录的副本，修改后不会影响缓存
+    record.plain_text = "changed"
+    record.message[0]["data"]["text"] = "changed"
+    record = await get_record_by_message_id(session, "4")
+    assert record and record.plain_text == "e"
+    assert record.message[0]["data"]["text"] == "e"
+
+    # 写入相同消息 id 的消息记录后清除缓存，读取最新的一条
+    await write_records(
+        [(new_session("10000"), new_record("4", "f", time=datetime(2024, 1, 2)))]
+    )
+    record = await get_record_by_message_id(session, "4")
+    assert record and record.plain_text == "f"
+
+
+async def test_get_context(app: App):
+    """测试获取消息的上下文"""
+
+    from nonebot_plugin_chatrecorder.record import get_context
+    from nonebot_plugin_chatrecorder.writer import write_records
+
+    # 时间相同的消息记录按 id 排序
+    await write_records(
+        [
+            (new_session("10000"), new_record("1", "1", datetime(2024, 1, 1, 0, 1))),
+            (
+                new_session("10000", user_id="20"),
+                new_record("2", "2", datetime(2024, 1, 1, 0, 2)),
+            ),
+            (new_session("10001"), new_record("3", "3", datetime(2024, 1, 1, 0, 3))),
+            (new_session("10000"), new_record("4", "4", datetime(2024, 1, 1, 0, 3))),
+            (new_session("10000"), new_record("5", "5", datetime(2024, 1, 1, 0, 3))),
+            (
+                new_session("10000", user_id="20"),
+                new_record("6", "6", datetime(2024, 1, 1, 0, 4)),
+            ),
+            (new_session("10000"), new_record("7", "7", datetime(2024, 1, 1, 0, 5))),
+        ]
+    )
+
+    session = new_session("10000", user_id="30")
+
+    async def context(message_id: str, before: int, after: int) -> list[str]:
+        records = await get_context(session, message_id, before, after)
+        return [record.message_id for record in records]
+
+    assert await context("4", 2, 2) == ["1", "2", "4", "5", "6"]
+    assert await context("5", 1, 1) == ["4", "5", "6"]
+    assert await context("2", 5, 5) == ["1", "2", "4", "5", "6", "7"]
+    assert await context("4", 0, 0) == ["4"]
+    assert await context("1", 1, 0) == ["1"]
+    assert await context("3", 1, 1) == []
+    assert await context("8", 1, 1) == []
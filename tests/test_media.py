@@ -0,0 +1,112 @@
+import base64
+import hashlib
+from datetime import datetime
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from nonebug.app import App
+
+from .utils import new_session
+
+
+async def test_media_store(app: App, tmp_path: Path):
+    """测试媒体文件缓存"""
+    from nonebot_plugin_chatrecorder.media import B64_CHUNK_SIZE, MediaStore
+
+    store = MediaStore(tmp_path)
+
+    data = bytes(range(256)) * (B64_CHUNK_SIZE // 128)
+    b64 = base64.b64encode(data).decode()
+    assert len(b64) > B64_CHUNK_SIZE
+
+    key = store.save_base64(b64)
+    assert key == hashlib.blake2b(data, digest_size=16).hexdigest()
+    assert store.exists(key)
+    assert store.path(key) == tmp_path / key[:2] / key[2:4] / f"{key}.cache"
+    assert store.path(key).read_bytes() == data
+    assert store.uri(key) == f"file:///{store.path(key).resolve()}"
+
+    # 重复保存时不会留下临时文件
+    wrapped = "\n".join(b64[i : i + 76] for i in range(0, len(b64), 76))
+    assert store.save_base64(wrapped) == key
+    assert list(tmp_path.glob("*.tmp")) == []
+    assert [path for path in tmp_path.rglob("*") if path.is_file()] == [store.path(key)]
+
+
+async def test_media_cache_manager(app: App, tmp_path: Path):
+    """测试媒体文件缓存清理"""
+    import os
+
+    from nonebot_plugin_orm import get_session
+    from sqlalchemy import select
+
+    from nonebot_plugin_chatrecorder.media import MediaStore
+    from nonebot_plugin_chatrecorder.media_cache import MediaCacheManager
+    from nonebot_plugin_chatrecorder.model import MessageRecord
+    from nonebot_plugin_chatrecorder.writer import write_records
+
+    session = new_session()
+    store = MediaStore(tmp_path)
+
+    # 文件按 key 的顺序依次变旧，a 最旧
+    keys = ["a" * 32, "b" * 32, "c" * 32]
+    for i, key in enumerate(keys):
+        path = store.save(key, b"0" * 100)
+        os.utime(path, (1000 - i, 1000 - i))
+    os.utime(store.path(keys[0]), (100, 100))
+
+    # a 仍被消息记录引用
+    await write_records(
+        [
+            (
+                session,
+                MessageRecord(
+                    time=datetime(2024, 1, 1),
+                    type="message",
+                    message_id="1",
+                    message=[{"type": "image", "data": {"file": store.uri(keys[0])}}],
+                    plain_text="",
+                ),
+            )
+        ]
+    )
+
+    async def get_file() -> str:
+        async with get_session() as db_session:
+            message = await db_session.scalar(select(MessageRecord.message))
+        assert message
+        return message[0]["data"]["file"]
+
+    # 未超出上限时不清理
+    manager = MediaCacheManager([store], max_size=300)
+    assert await manager.evict() == 0
+
+    # 保留被引用的文件，清理其余最旧的文件
+    manager = MediaCacheManager([store], max_size=200)
+    assert await manager.evict() == 1
+    assert [store.exists(key) for key in keys] == [True, True, False]
+
+    # 重复使用的文件会更新最近使用时间
+    store.save(keys[1], b"0" * 100)
+    assert store.path(keys[1]).stat().st_mtime > 1000
+
+    # 只查找给定文件的引用
+    manager = MediaCacheManager([store], max_size=100, policy="tombstone")
+    paths = [str(store.path(key).resolve()) for key in keys]
+    references = await manager.find_references(paths)
+    assert list(references) == [paths[0]]
+    assert await manager.find_references(paths[1:]) == {}
+
+    # 改写消息记录失败时不删除文件，下次清理时重试
+    with patch.object(manager, "tombstone", side_effect=RuntimeError):
+        with pytest.raises(RuntimeError):
+            await manager.evict()
+    assert store.exists(keys[0])
+    assert await get_file() == store.uri(keys[0])
+
+    # 清理被引用的文件并改写消息段
+    assert await manager.evict() == 1
+    assert [store.exists(key) for key in keys] == [False, True, False]
+    assert manager.tombstoned == 1
+    assert await get_file() == f"chatrecorder-evicted:///{keys[0]}.cache"
@@ -0,0 +1,157 @@
+import pytest
+from nonebot.adapters.feishu import Message as FeishuMsg
+from nonebot.adapters.feishu import MessageSegment as FeishuMsgSeg
+from nonebot.adapters.kaiheila import Message as KaiheilaMsg
+from nonebot.adapters.kaiheila import MessageSegment as KaiheilaMsgSeg
+from nonebot.adapters.onebot.v11 import Message as V11Msg
+from nonebot.adapters.onebot.v11 import MessageSegment as V11MsgSeg
+from nonebot.adapters.onebot.v12 import Message as V12Msg
+from nonebot.adapters.onebot.v12 import MessageSegment as V12MsgSeg
+from nonebot.adapters.qq import Message as QQMsg
+from nonebot.adapters.qq import MessageSegment as QQMsgSeg
+from nonebot.adapters.satori import Message as SatoriMsg
+from nonebot.adapters.satori import MessageSegment as SatoriMsgSeg
+from nonebot.adapters.telegram import Message as TelegramMsg
+from nonebot.adapters.telegram.message import Entity, File
+from nonebug.app import App
+
+
+async def test_deserialize_messages(app: App):
+    """测试批量反序列化消息"""
+    from nonebot_plugin_uninfo import SupportAdapter
+
+    from nonebot_plugin_chatrecorder.exception import AdapterNotSupported
+    from nonebot_plugin_chatrecorder.message import (
+        deserialize_message,
+        deserialize_messages,
+        get_adapter_type,
+        serialize_message,
+    )
+
+    assert get_adapter_type("OneBot V11") == SupportAdapter.onebot11
+    with pytest.raises(AdapterNotSupported):
+        get_adapter_type("Unknown")
+
+    v11_msgs = [
+        V11Msg("test message 1"),
+        V11Msg([V11MsgSeg.text("test"), V11MsgSeg.image(file="https://a.png")]),
+        V11Msg(),
+    ]
+    v12_msgs = [
+        V12Msg([V12MsgSeg.text("test"), V12MsgSeg.mention("10")]),
+        V12Msg("test message 2"),
+    ]
+    msgs = [
+        ("OneBot V11", serialize_message(SupportAdapter.onebot11, v11_msgs[0])),
+        (SupportAdapter.onebot12, serialize_message("OneBot V12", v12_msgs[0])),
+        ("OneBot V11", serialize_message(SupportAdapter.onebot11, v11_msgs[1])),
+        ("OneBot V11", serialize_message(SupportAdapter.onebot11, v11_msgs[2])),
+        ("OneBot V12", serialize_message(SupportAdapter.onebot12, v12_msgs[1])),
+    ]
+
+    for validate in (True, False):
+        results = deserialize_messages(msgs, validate=validate)
+        assert results == [
+            v11_msgs[0],
+            v12_msgs[0],
+            v11_msgs[1],
+            v11_msgs[2],
+            v12_msgs[1],
+        ]
+        assert [type(msg) for msg in results] == [
+            V11Msg,
+            V12Msg,
+            V11Msg,
+            V11Msg,
+            V12Msg,
+        ]
+        assert [type(seg) for seg in results[1]] == [V12MsgSeg, V12MsgSeg]
+        assert results == [deserialize_message(*msg, validate=validate) for msg in msgs]
+    assert deserialize_messages([]) == []
+
+    # 数据格式不符时回退到完整校验
+    assert deserialize_message(
+        "OneBot V11", [{"type": "text"}], validate=False
+    ) == V11Msg([V11MsgSeg("text", {})])
+
+    with pytest.raises(AdapterNotSupported):
+        deserialize_messages([("Unknown", [])])
+
+
+async def test_construct_messages(app: App):
+    """测试消息段有子类的适配器，直接构造与完整校验的结果一致"""
+    from nonebot_plugin_uninfo import SupportAdapter
+
+    from nonebot_plugin_chatrecorder.message import (
+        deserialize_message,
+        serialize_message,
+    )
+
+    msgs = [
+        (
+            SupportAdapter.qq,
+            QQMsg(
+                [
+                    QQMsgSeg.text("test"),
+                    QQMsgSeg.mention_user("10"),
+                    QQMsgSeg.image("https://a.png"),
+                    QQMsgSeg.emoji("1"),
+                    QQMsgSeg.reference("1"),
+                ]
+            ),
+        ),
+        (
+            SupportAdapter.satori,
+            SatoriMsg(
+                [
+                    SatoriMsgSeg.text("test"),
+                    SatoriMsgSeg.at("10"),
+                    SatoriMsgSeg.image(url="https://a.png"),
+                    SatoriMsgSeg.bold("bold"),
+                ]
+            ),
+        ),
+        (
+            SupportAdapter.telegram,
+            TelegramMsg(
+                [
+                    Entity.text("test"),
+                    Entity.bold("bold"),
+                    Entity.mention("@user"),
+                    File.photo("photo"),
+                ]
+            ),
+        ),
+        (
+            SupportAdapter.kook,
+            KaiheilaMsg(
+                [
+                    KaiheilaMsgSeg.text("test"),
+                    KaiheilaMsgSeg.KMarkdown("**bold**"),
+                    KaiheilaMsgSeg.mention("10"),
+                    KaiheilaMsgSeg.image("https://a.png"),
+                ]
+            ),
+        ),
+        (
+            SupportAdapter.feishu,
+            FeishuMsg(
+                [
+                    FeishuMsgSeg.text("test"),
+                    FeishuMsgSeg.at("ou_10"),
+                    FeishuMsgSeg.image("image_key"),
+                ]
+            ),
+        ),
+    ]
+
+    for adapter, msg in msgs:
+        json_msg = serialize_message(adapter, msg)
+        validated = deserialize_message(adapter, json_msg, validate=True)
+        constructed = deserialize_message(adapter, json_msg, validate=False)
+        assert constructed == validated
+        assert type(constructed) is type(validated) is type(msg)
+        assert [type(seg) for seg in constructed] == [type(seg) for seg in validated]
+        assert [(seg.type, seg.data) for seg in constructed] == [
+            (seg.type, seg.data) for seg in msg
+        ]
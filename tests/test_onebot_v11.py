@@ -1,4 +1,6 @@
+import hashlib
 from datetime import datetime, timezone
+from pathlib import Path
 from typing import Literal
 
 from nonebot import get_driver
@@ -219,3 +221,42 @@ async def test_record_send_msg(app: App):
         serialize_message(bot, message),
         message.extract_plain_text(),
     )
+
+
+async def test_cache_b64_msg(app: App):
+    """测试缓存 base64 形式的图片等"""
+    from nonebot.adapters.onebot.v11 import MessageSegment
+
+    from nonebot_plugin_chatrecorder.adapters.onebot_v11 import (
+        cache_b64_msg,
+        cache_b64_msg_async,
+    )
+
+    data = b"test image data"
+    message = Message(
+        [
+            MessageSegment.image(data),
+            MessageSegment.image(data),
+            MessageSegment.image("https://example.com/test.png"),
+        ]
+    )
+    cache_b64_msg(message)
+
+    file = message[0].data["file"]
+    assert file.startswith("file:///")
+    cache_path = Path(file.replace("file:///", "", 1))
+    assert cache_path.read_bytes() == data
+    assert cache_path.parent.name == cache_path.name[2:4]
+    assert cache_path.parent.parent.name == cache_path.name[:2]
+    assert message[1].data["file"] == file
+    assert message[2].data["file"] == "https://example.com/test.png"
+
+    message = Message([MessageSegment.record(data), MessageSegment.video(data)])
+    await cache_b64_msg_async(message)
+    for seg in message:
+        cache_path = Path(seg.data["file"].replace("file:///", "", 1))
+        assert cache_path.read_bytes() == data
+        assert (
+            cache_path.name
+            == f"{hashlib.blake2b(data, digest_size=16).hexdigest()}.cache"
+        )
@@ -0,0 +1,244 @@
+import asyncio
+from pathlib import Path
+from unittest.mock import patch
+
+from nonebug.app import App
+
+from .utils import new_record, new_session
+
+
+async def test_record_buffer(app: App):
+    """测试消息记录批量写入"""
+    from nonebot_plugin_orm import get_session
+    from nonebot_plugin_uninfo.orm import get_session_model
+    from sqlalchemy import func, select
+
+    from nonebot_plugin_chatrecorder.model import MessageRecord
+    from nonebot_plugin_chatrecorder.writer import RecordBuffer
+
+    session = new_session()
+
+    async def count_records() -> int:
+        async with get_session() as db_session:
+            return (await db_session.scalar(select(func.count(MessageRecord.id)))) or 0
+
+    # 达到批量大小时写入
+    buffer = RecordBuffer(batch_size=3, flush_interval=100, max_queue_size=100)
+    tasks = [
+        asyncio.create_task(buffer.put(session, new_record(str(i)))) for i in range(2)
+    ]
+    await asyncio.sleep(0.1)
+    assert len(buffer) == 2
+    assert await count_records() == 0
+
+    await buffer.put(session, new_record("2"))
+    await asyncio.gather(*tasks)
+    assert len(buffer) == 0
+    assert await count_records() == 3
+
+    # 超过等待时间时写入
+    buffer = RecordBuffer(batch_size=10, flush_interval=0.1, max_queue_size=100)
+    await asyncio.wait_for(buffer.put(session, new_record("3")), timeout=5)
+    assert await count_records() == 4
+
+    # 手动写入
+    buffer = RecordBuffer(batch_size=10, flush_interval=100, max_queue_size=100)
+    task = asyncio.create_task(buffer.put(session, new_record("4")))
+    await asyncio.sleep(0.1)
+    assert await count_records() == 4
+    await buffer.flush()
+    await task
+    assert await count_records() == 5
+
+    # 会话在写入消息记录的事务中创建
+    async with get_session() as db_session:
+        records = (await db_session.scalars(select(MessageRecord))).all()
+    assert len({record.session_persist_id for record in records}) == 1
+    session_model = await get_session_model(records[0].session_persist_id)
+    record_session = await session_model.to_session()
+    assert record_session.scene.id == session.scene.id
+    assert record_session.user.id == session.user.id
+
+
+async def test_record_buffer_nonblocking(app: App, tmp_path: Path):
+    """测试非阻塞写入"""
+    from nonebot_plugin_orm import get_session
+    from sqlalchemy import select
+
+    from nonebot_plugin_chatrecorder.model import MessageRecord
+    from nonebot_plugin_chatrecorder.spool import RecordSpool
+    from nonebot_plugin_chatrecorder.writer import RecordBuffer
+
+    session = new_session()
+
+    async def get_message_ids() -> set[str]:
+        async with get_session() as db_session:
+            return set(
+                (await db_session.scalars(select(MessageRecord.message_id))).all()
+            )
+
+    # 队列已满时丢弃最早的消息记录
+    buffer = RecordBuffer(
+        batch_size=10,
+        flush_interval=100,
+        max_queue_size=10,
+        nonblocking=True,
+        overflow_policy="drop_oldest",
+    )
+    for i in range(11):
+        await buffer.put(session, new_record(str(i)))
+    assert len(buffer) == 10
+    assert buffer.dropped == 1
+    assert await get_message_ids() == set()
+
+    await buffer.flush()
+    assert buffer.written == 10
+    assert await get_message_ids() == {str(i) for i in range(1, 11)}
+
+    # 队列已满时写入暂存文件，之后重放
+    spool = RecordSpool(tmp_path / "spool.jsonl")
+    buffer = RecordBuffer(
+        batch_size=10,
+        flush_interval=100,
+        max_queue_size=10,
+        nonblocking=True,
+        overflow_policy="spill",
+        spool=spool,
+    )
+    for i in range(11, 22):
+        await buffer.put(session, new_record(str(i)))
+    assert len(buffer) == 10
+    assert buffer.spilled == 1
+    assert spool
+
+    await buffer.flush()
+    assert not spool
+    assert buffer.written == 11
+    assert await get_message_ids() == {str(i) for i in range(1, 22)}
+
+
+async def test_record_buffer_spool(app: App, tmp_path: Path):
+    """测试数据库不可用时暂存消息记录"""
+    from nonebot_plugin_orm import get_session
+    from sqlalchemy import exc, select
+
+    from nonebot_plugin_chatrecorder import writer
+    from nonebot_plugin_chatrecorder.model import MessageRecord
+    from nonebot_plugin_chatrecorder.spool import RecordSpool
+    from nonebot_plugin_chatrecorder.writer import RecordBuffer, write_records
+
+    session = new_session()
+
+    async def get_message_ids() -> list[str]:
+        async with get_session() as db_session:
+            return list(
+                (await db_session.scalars(select(MessageRecord.message_id))).all()
+            )
+
+    async def unavailable(*args, **kwargs):
+        raise exc.OperationalError("INSERT", {}, Exception("database is locked"))
+
+    spool = RecordSpool(tmp_path / "spool.jsonl")
+    buffer = RecordBuffer(
+        batch_size=1, flush_interval=100, max_queue_size=100, spool=spool
+    )
+    with patch.object(writer, "write_records", unavailable):
+        await buffer.put(session, new_record("1"))
+        await buffer.put(session, new_record("2"))
+    assert buffer.spilled == 2
+    assert spool
+    assert await get_message_ids() == []
+
+    # 重放时跳过已写入的消息记录
+    await write_records([(session, new_record("1"))])
+    await buffer.replay_spool()
+    assert not spool
+    assert sorted(await get_message_ids()) == ["1", "2"]
+
+
+async def test_recent_messages(app: App):
+    """测试保存最近的消息"""
+
+    from nonebot_plugin_chatrecorder.recent import RecentMessages
+    from nonebot_plugin_chatrecorder.writer import RecordBuffer
+
+    def texts(msgs) -> list[str]:
+        return [msg[0]["data"]["text"] for msg in msgs]
+
+    recent = RecentMessages(scene_size=3, max_size=5)
+    buffer = RecordBuffer(
+        batch_size=10,
+        flush_interval=100,
+        max_queue_size=100,
+        nonblocking=True,
+        recent=recent,
+    )
+    for i in range(4):
+        await buffer.put(new_session("1", user_id=str(i)), new_record(f"a{i}", f"a{i}"))
+    await buffer.put(new_session("2"), new_record("b0", "b0"))
+    await buffer.flush()
+
+    # 每个事件场景最多保存 scene_size 条，按事件场景而不是用户保存
+    assert len(recent) == 4
+    assert texts(recent.get(new_session("1", user_id="20"), 3)) == ["a1", "a2", "a3"]
+    assert texts(recent.get(new_session("1"), 1)) == ["a3"]
+    assert recent.get(new_session("1"), 4) is None
+    assert recent.get(new_session("3"), 1) is None
+    assert (recent.hits, recent.misses) == (2, 2)
+
+    # 超过 max_size 时清理最久未访问的事件场景
+    await buffer.put(new_session("3"), new_record("c0", "c0"))
+    await buffer.put(new_session("3"), new_record("c1", "c1"))
+    await buffer.flush()
+    assert len(recent) == 5
+    assert recent.get(new_session("2"), 1) is None
+    assert texts(recent.get(new_session("1"), 3)) == ["a1", "a2", "a3"]
+    assert texts(recent.get(new_session("3"), 2)) == ["c0", "c1"]
+
+    # 修改原消息不会影响保存的消息
+    record = new_record("d0", "d0")
+    await buffer.put(new_session("4"), record)
+    record.message[0]["data"]["text"] = "changed"
+    assert texts(recent.get(new_session("4"), 1)) == ["d0"]
+    await buffer.flush()
+
+
+async def test_record_buffer_put_during_replay(app: App, tmp_path: Path):
+    """测试重放暂存消息记录期间加入的消息记录不会等待重放完成"""
+    from nonebot_plugin_orm import get_session
+    from sqlalchemy import select
+
+    from nonebot_plugin_chatrecorder import writer
+    from nonebot_plugin_chatrecorder.model import MessageRecord
+    from nonebot_plugin_chatrecorder.spool import RecordSpool
+    from nonebot_plugin_chatrecorder.writer import RecordBuffer
+
+    session = new_session()
+    write_records = writer.write_records
+    replay_started = asyncio.Event()
+    replay_blocked = asyncio.Event()
+
+    async def blocked_replay(entries, deduplicate=False):
+        if deduplicate:
+            replay_started.set()
+            await replay_blocked.wait()
+        return await write_records(entries, deduplicate)
+
+    spool = RecordSpool(tmp_path / "spool.jsonl")
+    spool.append([(session, new_record("1"))])
+    buffer = RecordBuffer(
+        batch_size=1, flush_interval=100, max_queue_size=100, spool=spool
+    )
+    with patch.object(writer, "write_records", blocked_replay):
+        await buffer.put(session, new_record("2"))
+        await asyncio.wait_for(replay_started.wait(), timeout=5)
+        await asyncio.wait_for(buffer.put(session, new_record("3")), timeout=5)
+        assert buffer.written == 2
+
+        replay_blocked.set()
+        await buffer.flush()
+    assert not spool
+
+    async with get_session() as db_session:
+        message_ids = (await db_session.scalars(select(MessageRecord.message_id))).all()
+    assert sorted(message_ids) == ["1", "2", "3"]
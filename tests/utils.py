@@ -6,11 +6,39 @@ from nonebot.log import logger
 if TYPE_CHECKING:
     from nonebot_plugin_uninfo import Session
 
+    from nonebot_plugin_chatrecorder.model import MessageRecord
+
 
 def session_id(session: "Session") -> str:
     return f"{session.self_id}_{session.adapter}_{session.scope}_{session.id}"
 
 
+def new_session(scene_id: str = "10000", user_id: str = "10") -> "Session":
+    from nonebot_plugin_uninfo import Scene, SceneType, Session, User
+
+    return Session(
+        self_id="11",
+        adapter="OneBot V11",
+        scope="QQClient",
+        scene=Scene(id=scene_id, type=SceneType.GROUP),
+        user=User(id=user_id),
+    )
+
+
+def new_record(
+    message_id: str, text: str = "test", time: datetime = datetime(2024, 1, 1)
+) -> "MessageRecord":
+    from nonebot_plugin_chatrecorder.model import MessageRecord
+
+    return MessageRecord(
+        time=time,
+        type="message",
+        message_id=message_id,
+        message=[{"type": "text", "data": {"text": text}}],
+        plain_text=text,
+    )
+
+
 async def check_record(
     session: Optional["Session"],
     time: Optional[datetime],